@@ -0,0 +1,183 @@
+import os
+import re
+import time
+from sqlalchemy import Index, MetaData, text
+
+from database import SQLite, remove
+import profiler
+
+# fraction of the rows of the driving table copied to the sample database
+SAMPLE_FRACTION = 0.05
+# (table, key) whose sampled keys select the rows of the other tables, the first one in base is used
+DRIVING_TABLES = [('cardmembers', 'cims_acct_key'), ('visitors', 'visitor_id')]
+# timed runs per query, the fastest counts
+REPEAT = 3
+# widest index proposed, key and covered columns together
+MAX_COLUMNS = 6
+
+def workload(queries):
+	'''
+	(sql, params, weight) of a captured workload: a QueryProfiler (weights are the calls)
+	or a list of sql strings or (sql, params) pairs. only selects are kept.
+	'''
+	if isinstance(queries, profiler.QueryProfiler):
+		profile = queries.profile()
+		items = [(sql, params, profile[key]['calls']) for key, (sql, params) in queries.examples.items() if key in profile]
+	else:
+		items = [(q, None, 1) if isinstance(q, str) else (q[0], q[1], 1) for q in queries]
+	return [(sql, params, weight) for sql, params, weight in items
+		if sql.lstrip().upper().startswith(('SELECT', 'WITH'))]
+
+def problems(cn, sql, params):
+	# (tables scanned without an index, uses a temp b-tree for sorting) of a query plan
+	plan = [r[-1] for r in cn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params or ())]
+	return profiler.full_scans(plan), any('TEMP B-TREE' in detail for detail in plan)
+
+def candidates(table, sql):
+	'''
+	indexes that could serve a query on table: equality columns of the where clause,
+	then group by or order by columns, then one range column, with and without the
+	other referenced columns of the table to cover the query.
+	'''
+	sql = ' '.join(sql.split())
+	where = _clause(sql, 'WHERE', ['GROUP BY', 'ORDER BY', 'LIMIT', 'HAVING'])
+	order = _clause(sql, 'GROUP BY', ['HAVING', 'ORDER BY', 'LIMIT']) + ' ' + _clause(sql, 'ORDER BY', ['LIMIT'])
+	columns = [c.name for c in table.columns]
+	equality = [c for c in columns if re.search(rf'\b{c}\s*(=|IN\b|IS\b)', where, re.IGNORECASE)]
+	ordered = sorted([c for c in columns if c not in equality and re.search(rf'\b{c}\b', order)],
+		key=lambda c: re.search(rf'\b{c}\b', order).start())
+	# a range on an ordered column is served by its position in the order
+	ranges = [c for c in columns if c not in equality and c not in ordered and \
+		re.search(rf'\b{c}\s*(<|>|BETWEEN\b|LIKE\b)', where, re.IGNORECASE)]
+	key = equality + ordered + ranges[:1]
+	if len(key) == 0:
+		return []
+	referenced = [c for c in columns if c not in key and re.search(rf'\b{c}\b', sql)]
+	proposals = [tuple(key[:MAX_COLUMNS])]
+	if len(referenced) > 0 and len(key) < MAX_COLUMNS:
+		proposals.append(tuple((key + referenced)[:MAX_COLUMNS]))
+	# a prefix of the primary key or of an existing index is already there
+	existing = [tuple(c.name for c in table.primary_key.columns)] + \
+		[tuple(c.name for c in index.columns) for index in table.indexes]
+	return [p for p in proposals if not any(e[:len(p)] == p for e in existing)]
+
+def sample(db, base, sample_path, fraction=SAMPLE_FRACTION, driving_tables=DRIVING_TABLES):
+	'''
+	copy of the schema of base with a random fraction of the keys of the driving table, e.g. accounts,
+	and the rows of every table related to them so that joins still match: the tables with the key
+	column, then the tables sharing a primary key column with a sampled table (e.g. campaigns of the
+	sampled applications). other tables are copied in full. db can be a partitions.PartitionedStore.
+	'''
+	start_time = time.time()
+	sample_db = SQLite(sample_path, create=True, renew=True, read_only=False)
+	sample_db.connect(base)
+	threshold = int(fraction * 1000000)
+	tables = base.metadata.tables
+	driving, key = next(((t, k) for t, k in driving_tables if t in tables), (None, None))
+	sampled = []
+	if driving is not None:
+		_copy(db, driving, sample_path, f'WHERE abs(random()) % 1000000 < {threshold}')
+		sampled.append(tables[driving])
+		for table in base.metadata.sorted_tables:
+			if table.name != driving and key in table.c:
+				_copy(db, table.name, sample_path, f'WHERE {key} IN (SELECT {key} FROM sample.{driving})')
+				sampled.append(table)
+	remaining = [t for t in base.metadata.sorted_tables if t not in sampled]
+	while len(remaining) > 0:
+		related = [(t, c.name) for t in remaining for c in t.primary_key.columns if any(c.name in s.c for s in sampled)]
+		if len(related) == 0:
+			break
+		table, column = related[0]
+		# values of column in any sampled table
+		values = ' UNION '.join(f'SELECT {column} FROM sample.{s.name}' for s in sampled if column in s.c)
+		_copy(db, table.name, sample_path, f'WHERE {column} IN ({values})')
+		sampled.append(table)
+		remaining.remove(table)
+	for table in remaining:
+		_copy(db, table.name, sample_path, f'WHERE abs(random()) % 1000000 < {threshold}' if driving is None else '')
+	with sample_db.engine.connect() as cn:
+		cn.execution_options(isolation_level='AUTOCOMMIT').execute(text('ANALYZE'))
+	print(f'finished sampling {db.db_path} into {sample_path}, took {int(time.time() - start_time)}s.')
+	return sample_db
+
+def _copy(db, name, sample_path, where):
+	# insert the rows of a table into the attached sample, one partition at a time for a partitions.PartitionedStore
+	for cn in db.connections(name):
+		cn.execute(text('ATTACH DATABASE :path AS sample'), {'path': sample_path})
+		try:
+			cn.execute(text(f'INSERT INTO sample.{name} SELECT * FROM main.{name} {where}'))
+		finally:
+			cn.execute(text('DETACH DATABASE sample'))
+
+def advise(db, base, queries, sample_path=None, fraction=SAMPLE_FRACTION, repeat=REPEAT):
+	'''
+	propose indexes for the full scans and temp b-tree sorts of a workload, measure each one
+	on a sampled copy of db and return the indexes that help, the most time saved first.
+	the result can be passed to db.create_indexes. the returned Index objects belong to
+	copies of the tables, base is left unchanged.
+	'''
+	start_time = time.time()
+	queries = workload(queries)
+	sample_path = sample_path or os.path.splitext(db.db_path)[0] + '_sample.db'
+	sample_db = sample(db, base, sample_path, fraction)
+	tables = base.metadata.tables
+	proposals = dict()
+	with sample_db.engine.connect() as cn:
+		baseline = [_time(cn, sql, params, repeat) for sql, params, _ in queries]
+		for i, (sql, params, _) in enumerate(queries):
+			scans, sorts = problems(cn, sql, params)
+			names = set(scans)
+			if sorts:
+				names.update(t for t in tables if re.search(rf'\b{t}\b', sql))
+			for name in names & set(tables):
+				for columns in candidates(tables[name], sql):
+					proposals.setdefault((name, columns), set()).add(i)
+
+		ranked = []
+		for (name, columns), affected in proposals.items():
+			index_name = f"ix_{name}_{'_'.join(columns)}"
+			cn.exec_driver_sql(f"CREATE INDEX {index_name} ON {name} ({', '.join(columns)})")
+			cn.exec_driver_sql(f'ANALYZE {index_name}')
+			saved = 0.0
+			used = False
+			for i in affected:
+				sql, params, weight = queries[i]
+				plan = ' '.join(r[-1] for r in cn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params or ()))
+				used = used or index_name in plan
+				saved += weight * (baseline[i] - _time(cn, sql, params, repeat))
+			cn.exec_driver_sql(f'DROP INDEX {index_name}')
+			cn.commit()
+			if used and saved > 0:
+				ranked.append((saved, index_name, name, columns))
+	sample_db.close()
+	remove(sample_path)
+
+	indexes = []
+	chosen = []
+	metadata = MetaData()
+	existing = {index.name for table in tables.values() for index in table.indexes}
+	for saved, index_name, name, columns in sorted(ranked, reverse=True):
+		# a prefix of a better index is served by it
+		if index_name in existing or any(n == name and c[:len(columns)] == columns for n, c in chosen):
+			continue
+		chosen.append((name, columns))
+		print(f'{index_name} saves {round(saved / fraction, 3)}s per run of the workload (estimated from the sample).')
+		table = metadata.tables.get(name)
+		if table is None:
+			table = tables[name].to_metadata(metadata)
+		indexes.append(Index(index_name, *[table.c[c] for c in columns]))
+	print(f'finished advising {len(indexes)} indexes for {len(queries)} queries, took {int(time.time() - start_time)}s.')
+	return indexes
+
+def _clause(sql, keyword, ends):
+	match = re.search(rf'\b{keyword}\b(.*?)(\b(?:{"|".join(ends)})\b|$)', sql, re.IGNORECASE)
+	return match.group(1) if match else ''
+
+def _time(cn, sql, params, repeat):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		cn.exec_driver_sql(sql, params or ()).fetchall()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
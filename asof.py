@@ -0,0 +1,121 @@
+from operator import itemgetter
+import time
+import numpy as np
+from sqlalchemy import text
+
+from entities_ana import CardmemberProfile, ExternalVariables, MarketingEligibilityHistory, \
+	ModelScoreHistory, RiskEligibilityHistory
+
+# account history tables and their period column
+ACCOUNT_TABLES = [
+	(CardmemberProfile, 'perf_mnth'),
+	(ModelScoreHistory, 'perf_mthly_dt'),
+	(RiskEligibilityHistory, 'perf_week'),
+	(MarketingEligibilityHistory, 'perf_week'),
+]
+# tables that apply to every account
+GLOBAL_TABLES = [
+	(ExternalVariables, 'perf_week'),
+]
+
+# number of queries joined at a time, memory is bounded by the history of their accounts
+BLOCK_SIZE = 1000000
+# days per account in the combined (account, day) search key
+DAYS = 1 << 20
+
+def feature_columns(entity, period):
+	return [c for c in entity.__table__.columns if c.key not in {'cims_acct_key', period}]
+
+def asof_join(db, accounts, dates, account_tables=ACCOUNT_TABLES, global_tables=GLOBAL_TABLES, block_size=BLOCK_SIZE):
+	'''
+	for each (account, as-of date) take the latest row at or before the date of every table.
+	queries are sorted and processed in blocks of accounts, each table is read once per block
+	in primary key order and matched with searchsorted. returns a dict of column arrays in the
+	order of the queries, including the matched period of each table as <table>_period.
+	numeric features are float with nan when there is no row, text features are objects with None.
+	'''
+	start_time = time.time()
+	accounts = np.asarray(accounts, dtype=np.int64)
+	dates = np.asarray(dates, dtype='datetime64[D]')
+	n = len(accounts)
+	order = np.lexsort((dates, accounts))
+	accounts, dates = accounts[order], dates[order]
+	days = _days(dates)
+
+	features = {'cims_acct_key': accounts, 'as_of': dates}
+	for entity, period in account_tables + global_tables:
+		features[f'{entity.__tablename__}_period'] = np.full(n, np.datetime64('NaT'), dtype='datetime64[D]')
+		for c in feature_columns(entity, period):
+			features[c.key] = _empty(c, n)
+
+	# db can be a partitions.PartitionedStore, rows after the last date are not needed
+	end = str(dates.max()) if n > 0 else None
+	# a block never splits the queries of an account
+	start = 0
+	while start < n:
+		stop = min(start + block_size, n)
+		if stop < n:
+			stop = int(np.searchsorted(accounts, accounts[stop - 1], side='right'))
+		block = slice(start, stop)
+		unique = np.unique(accounts[block])
+		ranks = np.searchsorted(unique, accounts[block])
+		for entity, period in account_tables:
+			rows = _read(db, entity, period, 'WHERE cims_acct_key BETWEEN :lo AND :hi',
+				{'lo': int(unique[0]), 'hi': int(unique[-1])}, end, with_account=True)
+			t_ranks = np.searchsorted(unique, rows['cims_acct_key'])
+			keep = unique[np.minimum(t_ranks, len(unique) - 1)] == rows['cims_acct_key']
+			t_keys = t_ranks[keep] * DAYS + _days(rows[period][keep])
+			index = np.searchsorted(t_keys, ranks * DAYS + days[block], side='right') - 1
+			hit = index >= 0
+			hit[hit] = t_ranks[keep][index[hit]] == ranks[hit]
+			_assign(features, entity, period, rows, keep, index, hit, block)
+		start = stop
+
+	for entity, period in global_tables:
+		rows = _read(db, entity, period, '', dict(), end)
+		index = np.searchsorted(_days(rows[period]), days, side='right') - 1
+		_assign(features, entity, period, rows, np.ones(len(rows[period]), dtype=bool), index, index >= 0, slice(0, n))
+
+	# back to the order of the queries
+	inverse = np.empty(n, dtype=np.int64)
+	inverse[order] = np.arange(n)
+	features = {k: v[inverse] for k, v in features.items()}
+	print(f'finished as-of join of {n} queries, took {int(time.time() - start_time)}s.')
+	return features
+
+def _read(db, entity, period, where, params, end, with_account=False):
+	# rows sorted by (account,) period as column arrays, read with the driver to skip type processing.
+	# the partitions of a partitions.PartitionedStore are merged on the same order
+	columns = (['cims_acct_key'] if with_account else []) + [period] + [c.key for c in feature_columns(entity, period)]
+	order = 'cims_acct_key, ' + period if with_account else period
+	query = text(f'SELECT {", ".join(columns)} FROM {entity.__tablename__} {where} ORDER BY {order}')
+	rows = db.stream_rows(entity, query, params, end=end, key=itemgetter(0, 1) if with_account else itemgetter(0))
+	values = list(zip(*rows)) or [[] for _ in columns]
+	rows = dict()
+	for name, v in zip(columns, values):
+		if name == period:
+			rows[name] = np.array(v, dtype='datetime64[D]')
+		elif name == 'cims_acct_key':
+			rows[name] = np.array(v, dtype=np.int64)
+		else:
+			rows[name] = np.array(v, dtype=_dtype(entity.__table__.c[name]))
+	return rows
+
+def _assign(features, entity, period, rows, keep, index, hit, block):
+	target = np.arange(block.start, block.stop)[hit]
+	source = index[hit]
+	features[f'{entity.__tablename__}_period'][target] = rows[period][keep][source]
+	for c in feature_columns(entity, period):
+		features[c.key][target] = rows[c.key][keep][source]
+
+def _days(dates):
+	# days shifted to be positive within the key
+	return dates.astype('datetime64[D]').astype(np.int64) + DAYS // 2
+
+def _dtype(column):
+	return np.float64 if column.type.python_type in {int, float} else object
+
+def _empty(column, n):
+	if _dtype(column) is object:
+		return np.full(n, None, dtype=object)
+	return np.full(n, np.nan)
@@ -0,0 +1,51 @@
+import time
+from sqlalchemy import select, text
+
+from entities import ApplicationCurrentState
+
+# number of ids per lookup, below the sqlite limit of bound parameters
+CHUNK_SIZE = 500
+
+def install(db):
+	'''
+	backfill application_current_state from the applications already loaded and install
+	the trigger that moves an application to its newest status on every insert.
+	'''
+	start_time = time.time()
+	with db.engine.begin() as cn:
+		cn.execute(text('DROP TRIGGER IF EXISTS application_current_state_insert'))
+		cn.execute(text('DELETE FROM application_current_state'))
+		# sqlite takes the bare columns from the row with the max status_dt
+		cn.execute(text('''
+			INSERT INTO application_current_state (application_id, status_dt, status, visitor_id, campaign_id)
+			SELECT application_id, max(status_dt), status, visitor_id, campaign_id
+			FROM applications
+			GROUP BY application_id
+		'''))
+		# rows arriving out of order do not move an application back to an older status
+		cn.execute(text('''
+			CREATE TRIGGER application_current_state_insert AFTER INSERT ON applications
+			BEGIN
+				INSERT INTO application_current_state (application_id, status_dt, status, visitor_id, campaign_id)
+				VALUES (NEW.application_id, NEW.status_dt, NEW.status, NEW.visitor_id, NEW.campaign_id)
+				ON CONFLICT (application_id) DO UPDATE SET
+					status_dt = excluded.status_dt,
+					status = excluded.status,
+					visitor_id = excluded.visitor_id,
+					campaign_id = excluded.campaign_id
+				WHERE excluded.status_dt >= application_current_state.status_dt;
+			END
+		'''))
+	print(f'finished installing the application current state, took {int(time.time() - start_time)}s.')
+
+def latest(db, application_ids):
+	# latest state of each application by id, unknown ids are left out
+	table = ApplicationCurrentState.__table__
+	application_ids = list(application_ids)
+	states = dict()
+	with db.engine.connect() as cn:
+		for i in range(0, len(application_ids), CHUNK_SIZE):
+			query = select(table).where(table.c.application_id.in_(application_ids[i:i + CHUNK_SIZE]))
+			for row in cn.execute(query):
+				states[row.application_id] = row
+	return states
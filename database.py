@@ -1,61 +1,598 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date, datetime
+import functools
+import hashlib
+import heapq
+import itertools
 import os
+import shutil
+import numpy as np
+import sqlite3
 import sqlalchemy
-from sqlalchemy import event, text
-from sqlalchemy.engine import Engine
+from sqlalchemy import event, insert, inspect, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateIndex, CreateTable
 import time
 
-@event.listens_for(Engine, 'connect')
-def set_sqlite_pragma(cn, _):
+import profiler
+
+# pragmas applied to every new connection, by profile name. auto_vacuum only takes effect
+# when the database is created, freed pages are then returned by incremental_vacuum
+PRAGMA_PROFILES = {
+	'default': {
+		'page_size': 4096,
+		'auto_vacuum': 'INCREMENTAL',
+		'journal_mode': 'WAL',
+		'synchronous': 'NORMAL',
+		'cache_size': 1000000,
+		'temp_store': 'MEMORY',
+		'mmap_size': 30000000000,
+	},
+	# no durability until the load is finished, the database is rebuilt if it fails
+	'bulk_load': {
+		'page_size': 4096,
+		'auto_vacuum': 'INCREMENTAL',
+		'locking_mode': 'EXCLUSIVE',
+		'journal_mode': 'MEMORY',
+		'synchronous': 'OFF',
+		'cache_size': 2000000,
+		'temp_store': 'MEMORY',
+		'mmap_size': 30000000000,
+	},
+}
+
+# properties of the database file, set by the writer and skipped on read-only connections
+PERSISTENT_PRAGMAS = {'page_size', 'journal_mode', 'auto_vacuum'}
+# pragmas of the writer only, e.g. an exclusive lock cannot be taken by a read-only connection
+WRITER_PRAGMAS = {'locking_mode', 'synchronous'}
+
+# reader connections of the pool used by map_queries
+NUM_READERS = 4
+
+# rows sampled per index by ANALYZE
+ANALYSIS_LIMIT = 1000
+# pages returned to the file system per incremental vacuum step, one transaction each
+VACUUM_PAGES = 10000
+# WAL sizes above which checkpoint() copies the WAL back (PASSIVE) and also truncates it (TRUNCATE)
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+TRUNCATE_BYTES = 512 * 1024 * 1024
+
+# rows per chunk of stream_arrays
+ARRAY_CHUNK_SIZE = 100000
+# rows fetched at a time by stream_rows
+STREAM_BATCH_SIZE = 10000
+
+# in-memory database, one connection shared by the writer and the readers
+MEMORY = ':memory:'
+# template databases of SQLite.from_template, named by schema hash
+TEMPLATE_DIR = '.templates'
+
+def schema_hash(metadata, key=''):
+	# hash of the sqlite DDL of metadata, the file pragmas and a key of the seed data (e.g. its random seed)
+	dialect = sqlite.dialect()
+	ddl = [str(CreateTable(t).compile(dialect=dialect)) for t in metadata.sorted_tables]
+	ddl += [str(CreateIndex(i).compile(dialect=dialect))
+		for t in metadata.sorted_tables for i in sorted(t.indexes, key=lambda i: i.name)]
+	pragmas = {k: v for k, v in PRAGMA_PROFILES['default'].items() if k in PERSISTENT_PRAGMAS}
+	return hashlib.sha256('\n'.join(ddl + [repr(pragmas), repr(key)]).encode()).hexdigest()[:16]
+
+def set_sqlite_pragma(cn, pragmas):
 	cursor = cn.cursor()
-	cursor.execute('pragma page_size=4096;')
-	cursor.execute('pragma journal_mode=WAL;')
-	cursor.execute('pragma synchronous=NORMAL;')
-	cursor.execute('pragma cache_size=1000000;')
-	cursor.execute('pragma temp_size=MEMORY;')
-	cursor.execute('pragma mmap_size=30000000000;')
+	for name, value in pragmas.items():
+		cursor.execute(f'pragma {name}={value};')
 	cursor.close()
 
+def remove(db_path):
+	if os.path.exists(db_path):
+		os.remove(db_path)
+		for postfix in ['-shm', '-wal']:
+			if os.path.exists(db_path + postfix):
+				os.remove(db_path + postfix)
+
+def _to_table(entity):
+	return entity if isinstance(entity, sqlalchemy.Table) else entity.__table__
+
+def _upsert(table):
+	# insert ... on conflict (primary key) do update
+	statement = sqlite_insert(table)
+	keys = [c.key for c in table.primary_key.columns]
+	values = {c.key: statement.excluded[c.key] for c in table.columns if c.key not in keys}
+	if len(values) == 0:
+		return statement.on_conflict_do_nothing(index_elements=keys)
+	return statement.on_conflict_do_update(index_elements=keys, set_=values)
+
+def _defaults(table):
+	# scalar column defaults, applied to the rows that leave a column out
+	defaults = dict()
+	for c in table.columns:
+		defaults[c.key] = c.default.arg if c.default is not None and c.default.is_scalar else None
+	return defaults
+
+def _replace_rows(cn, table, column, values, rows, chunk_size, batch_size=500):
+	# delete and insert on the connection of an open transaction
+	values = list(values)
+	for i in range(0, len(values), batch_size):
+		cn.execute(table.delete().where(table.c[column].in_(values[i:i + batch_size])))
+	statement = insert(table)
+	defaults = _defaults(table)
+	total = 0
+	chunk = []
+	for row in rows:
+		chunk.append(_to_params(row, defaults))
+		if len(chunk) >= chunk_size:
+			cn.execute(statement, chunk)
+			total += len(chunk)
+			chunk = []
+	if len(chunk) > 0:
+		cn.execute(statement, chunk)
+		total += len(chunk)
+	return total
+
+def _to_query(query):
+	return text(query) if isinstance(query, str) else query
+
+def _stream_rows(engines, query, params, key):
+	# the rows of a select run on every engine, one engine after the other or merged on key
+	# when the selects are sorted by it. every stream holds one connection until it is exhausted
+	streams = [_rows(engine, query, params) for engine in engines]
+	if key is None:
+		return itertools.chain(*streams)
+	return heapq.merge(*streams, key=key)
+
+def _rows(engine, query, params):
+	with engine.connect() as cn:
+		cn = cn.execution_options(yield_per=STREAM_BATCH_SIZE)
+		yield from cn.execute(_to_query(query), params or dict())
+
+def _to_params(row, defaults):
+	if isinstance(row, dict):
+		return {**defaults, **row}
+	if isinstance(row, (tuple, list)):
+		return dict(zip(defaults.keys(), row))
+	# mapped object: only take the attributes that have been set
+	state = inspect(row)
+	params = dict(defaults)
+	for attr in state.mapper.column_attrs:
+		if attr.key in state.dict:
+			params[attr.columns[0].key] = state.dict[attr.key]
+	return params
+
+def column_dtype(column):
+	# numpy dtype of a mapped column, nullable integers and booleans are floats with nan for null
+	try:
+		python_type = column.type.python_type
+	except NotImplementedError:
+		return np.dtype(object)
+	nullable = getattr(column, 'nullable', True)
+	if python_type is datetime:
+		return np.dtype('datetime64[us]')
+	if python_type is date:
+		return np.dtype('datetime64[D]')
+	if python_type in {int, bool}:
+		return np.dtype(np.float64) if nullable else np.dtype(np.int64 if python_type is int else np.bool_)
+	if python_type is float:
+		return np.dtype(np.float64)
+	return np.dtype(object)
+
+def _backup(path, target):
+	source = sqlite3.connect(path)
+	source.backup(target)
+	source.close()
+
 class SQLite:
 
-	def __init__(self, db_path, create=False, renew=False, read_only=True):
+	def __init__(self, db_path, create=False, renew=False, read_only=True, profile='default', profiles=None,
+		defer_indexes=False, num_readers=NUM_READERS):
 		self.db_path = db_path
 		self.create = create
 		self.renew = renew
 		self.read_only = read_only
-		if renew and os.path.exists(db_path):
-			os.remove(db_path)
-			for postfix in ['-shm', '-wal']:
-				if os.path.exists(db_path + postfix):
-					os.remove(db_path + postfix)
+		# create tables without their secondary indexes, create_indexes() builds them after loading
+		self.defer_indexes = defer_indexes
+		self.deferred_indexes = []
+		# named pragma profiles of this instance, profiles can add or override PRAGMA_PROFILES
+		self.profiles = {**PRAGMA_PROFILES, **(profiles or dict())}
+		self.profile = profile
+		# size of the read-only connection pool, readers do not block the writer in WAL mode
+		self.num_readers = num_readers
+		self.profiler = None
+		if renew:
+			remove(db_path)
 
 	def connect(self, base):
-		cnstring = f'sqlite:///{self.db_path}'
-		if self.read_only:
-			cnstring == '?mode=ro'
-		self.engine = sqlalchemy.create_engine(cnstring, echo=False)
-		if self.create:
+		if self.db_path == MEMORY:
+			self.engine = sqlalchemy.create_engine('sqlite://', echo=False, poolclass=StaticPool,
+				connect_args={'check_same_thread': False})
+			event.listen(self.engine, 'connect', lambda cn, _: set_sqlite_pragma(cn, self._pragmas(False)))
+			self.readers = self.engine
+		else:
+			self.engine = sqlalchemy.create_engine(self._url(self.read_only), echo=False)
+			event.listen(self.engine, 'connect', lambda cn, _: set_sqlite_pragma(cn, self._pragmas(self.read_only)))
+			self.readers = sqlalchemy.create_engine(self._url(True), echo=False,
+				pool_size=self.num_readers, max_overflow=0)
+			event.listen(self.readers, 'connect', lambda cn, _: set_sqlite_pragma(cn, self._pragmas(True)))
+		if self.create and self.defer_indexes:
+			self._create_tables(base.metadata)
+		elif self.create:
 			base.metadata.create_all(self.engine)
 		Session = sessionmaker(bind=self.engine)
 		self.session = Session()
 		print(f'successfully connected to {self.db_path}.')
 
-	def create_indexes(self, indexes):
+	@classmethod
+	def from_template(cls, db_path, base, seed=None, key='', template_dir=TEMPLATE_DIR, method='copy', **kwargs):
+		'''
+		a fresh connected database with the schema of base and the rows written by seed(db), cloned from
+		a template built once per schema hash and key in template_dir. key identifies the seed data,
+		e.g. its random seed. method is 'copy' (file copy) or 'backup' (sqlite backup API), an in-memory
+		database (db_path ':memory:') is always restored with the backup API. kwargs go to SQLite.
+		'''
+		start_time = time.time()
+		defer_indexes = kwargs.get('defer_indexes', False)
+		template = os.path.join(template_dir, f'{schema_hash(base.metadata, (key, defer_indexes))}.db')
+		if not os.path.exists(template):
+			os.makedirs(template_dir, exist_ok=True)
+			# built under another name so that a failed build is never used
+			t = cls(template + '.build', create=True, renew=True, read_only=False, defer_indexes=defer_indexes)
+			t.connect(base)
+			if seed is not None:
+				seed(t)
+			t.optimize()
+			t.close()
+			os.replace(template + '.build', template)
+			print(f'finished building template {template}, took {round(time.time() - start_time, 2)}s.')
+
+		kwargs.setdefault('read_only', False)
+		db = cls(db_path, create=True, renew=True, **kwargs)
+		if db_path == MEMORY:
+			db.connect(base)
+			with db.engine.connect() as cn:
+				_backup(template, cn.connection.driver_connection)
+		else:
+			if method == 'backup':
+				target = sqlite3.connect(db_path)
+				_backup(template, target)
+				target.close()
+			else:
+				shutil.copyfile(template, db_path)
+			# tables exist already, create only records the deferred indexes
+			db.connect(base)
+		print(f'finished cloning {template} into {db_path}, took {round(time.time() - start_time, 3)}s.')
+		return db
+
+	def _url(self, read_only):
+		if read_only:
+			return f'sqlite:///file:{self.db_path}?mode=ro&uri=true'
+		return f'sqlite:///{self.db_path}'
+
+	def _pragmas(self, read_only):
+		pragmas = self.profiles[self.profile]
+		if read_only:
+			return {k: v for k, v in pragmas.items() if k not in PERSISTENT_PRAGMAS | WRITER_PRAGMAS}
+		return pragmas
+
+	def _create_tables(self, metadata):
+		# tables only, primary keys and unique constraints are part of the table definition
+		with self.engine.begin() as cn:
+			for table in metadata.sorted_tables:
+				cn.execute(CreateTable(table, if_not_exists=True))
+				self.deferred_indexes.extend(sorted(table.indexes, key=lambda i: i.name))
+
+	def set_profile(self, profile):
+		# pooled connections are closed so that every new connection picks up the profile
+		self.profile = profile
+		self.session.close()
+		if self.db_path == MEMORY:
+			# closing the only connection would drop the database, its pragmas are changed in place
+			with self.engine.connect() as cn:
+				set_sqlite_pragma(cn.connection.driver_connection, self._pragmas(False))
+			return
+		self.engine.dispose()
+		self.readers.dispose()
+
+	@contextmanager
+	def bulk_load(self, profile='bulk_load'):
+		previous = self.profile
+		self.set_profile(profile)
+		start_time = time.time()
+		try:
+			yield self
+		finally:
+			self.set_profile(previous)
+			self.checkpoint('TRUNCATE')
+			print(f'finished bulk loading {self.db_path}, took {int(time.time() - start_time)}s.')
+
+	def bulk_insert(self, entity, rows, chunk_size=100000, upsert=False):
+		# entity can be a mapped class or a table, rows can be dicts, tuples or mapped objects.
+		# upsert updates the rows whose primary key already exists instead of failing
+		table = _to_table(entity)
+		start_time = time.time()
+		total = self._insert_rows(table, rows, chunk_size, _upsert(table) if upsert else insert(table))
+		elapsed = time.time() - start_time
+		print(f'finished inserting {total} rows into {table.name}, took {int(elapsed)}s ' + \
+			f'({int(total / max(elapsed, 1e-6))} rows/s).')
+		return total
+
+	def stream_insert(self, batches, chunk_size=100000, upsert=False):
+		# batches yields (entity, rows) pairs, rows are consumed lazily so memory stays bounded by the batch
+		start_time = time.time()
+		totals = dict()
+		for entity, rows in batches:
+			table = _to_table(entity)
+			statement = _upsert(table) if upsert else insert(table)
+			totals[table.name] = totals.get(table.name, 0) + self._insert_rows(table, rows, chunk_size, statement)
+		elapsed = time.time() - start_time
+		for name, total in totals.items():
+			print(f'finished inserting {total} rows into {name}.')
+		total = sum(totals.values())
+		print(f'finished streaming {total} rows, took {int(elapsed)}s ({int(total / max(elapsed, 1e-6))} rows/s).')
+		return totals
+
+	def replace(self, entity, column, values, rows, chunk_size=100000):
+		'''
+		delete the rows of entity whose column is in values and insert rows instead, in one transaction,
+		e.g. the restated periods of a snapshot. rows must not write to the database while being read.
+		'''
+		table = _to_table(entity)
+		start_time = time.time()
+		with self.engine.begin() as cn:
+			total = _replace_rows(cn, table, column, values, rows, chunk_size)
+		print(f'finished replacing {total} rows of {len(values)} {column} in {table.name}, ' + \
+			f'took {int(time.time() - start_time)}s.')
+		return total
+
+	def _insert_rows(self, table, rows, chunk_size, statement):
+		defaults = _defaults(table)
+		total = 0
+		chunk = []
+		for row in rows:
+			chunk.append(_to_params(row, defaults))
+			if len(chunk) >= chunk_size:
+				total += self._insert_chunk(statement, chunk)
+				chunk = []
+		if len(chunk) > 0:
+			total += self._insert_chunk(statement, chunk)
+		return total
+
+	def _insert_chunk(self, statement, chunk):
+		# one transaction per chunk
+		with self.engine.begin() as cn:
+			cn.execute(statement, chunk)
+		return len(chunk)
+
+	def instrument(self, slow_seconds=profiler.SLOW_SECONDS, explain=True):
+		# record the cost of every statement of the writer and the readers, see profiler.py.
+		# calls of at least slow_seconds are counted as slow, the first one of a select is explained
+		if self.profiler is None:
+			self.profiler = profiler.QueryProfiler(slow_seconds, explain)
+			self.profiler.attach(self.engine)
+			self.profiler.attach(self.readers)
+		return self.profiler
+
+	@contextmanager
+	def read(self, start=None, end=None, tables=None):
+		'''
+		an autocommit connection reading the histories of [start, end], the range and the tables
+		(names) that are read prune a partitions.PartitionedStore only.
+		'''
+		with self.engine.connect() as cn:
+			yield cn.execution_options(isolation_level='AUTOCOMMIT')
+
+	def stream_rows(self, entity, query, params=None, start=None, end=None, key=None):
+		'''
+		iterate over the rows of a select of one table (entity, table or name), fetched in batches.
+		a partitions.PartitionedStore runs it on every partition overlapping [start, end] and
+		merges the partitions on key (rows of a select sorted by it), here there is one stream.
+		'''
+		return _stream_rows([self._readers()], query, params, key)
+
+	def connections(self, entity, start=None, end=None):
+		# autocommit connections holding the rows of one table, one per partition of a partitions.PartitionedStore
+		with self.engine.connect() as cn:
+			yield cn.execution_options(isolation_level='AUTOCOMMIT')
+
+	def _readers(self):
+		# the engine of reads, under an exclusive lock (the bulk_load profile) only the writer can open the file
+		if str(self._pragmas(False).get('locking_mode', '')).upper() == 'EXCLUSIVE':
+			return self.engine
+		return self.readers
+
+	def map_queries(self, queries, params=None, max_workers=None):
+		'''
+		run independent selects in parallel on the read-only pool and yield (key, rows) as they finish.
+		queries is a dict of key to query or a list (keys are the positions), a query is sql text,
+		a selectable or a (query, params) pair. the database should be in WAL mode (the default profile)
+		so that the readers do not wait for each other or for a writer, inside bulk_load the queries
+		run one at a time on the writer.
+		'''
+		if not isinstance(queries, dict):
+			queries = dict(enumerate(queries))
+		start_time = time.time()
+		if self._readers() is self.engine and self.db_path != MEMORY:
+			max_workers = 1
+		with ThreadPoolExecutor(max_workers=max_workers or self.num_readers) as executor:
+			futures = {executor.submit(self._read, query, params): key for key, query in queries.items()}
+			for future in as_completed(futures):
+				yield futures[future], future.result()
+		print(f'finished {len(queries)} queries, took {round(time.time() - start_time, 2)}s.')
+
+	def _read(self, query, params):
+		if isinstance(query, tuple):
+			query, params = query
+		with self._readers().connect() as cn:
+			return cn.execute(_to_query(query), params or dict()).all()
+
+	def stream_arrays(self, source, columns=None, where=None, params=None, chunk_size=ARRAY_CHUNK_SIZE, structured=True):
+		'''
+		stream the rows of a table (entity or table, optionally columns and a where clause in sql)
+		or of a select as numpy structured arrays of at most chunk_size rows, or dicts of column arrays
+		when structured is False. dtypes follow the mapped types (see column_dtype), rows are fetched
+		from the driver cursor with fetchmany and never become mapped objects, memory is bounded by one chunk.
+		'''
+		if isinstance(source, sqlalchemy.Select):
+			query = source
+		else:
+			table = _to_table(source)
+			query = sqlalchemy.select(*[table.c[c] for c in columns] if columns else table.columns)
+			if where is not None:
+				query = query.where(text(where))
+		selected = list(query.selected_columns)
+		dtype = np.dtype([(c.key, column_dtype(c)) for c in selected])
+		with self._readers().connect() as cn:
+			# sqlalchemy binds the parameters (e.g. expanding IN lists), the rows are fetched from
+			# the driver cursor of the result, which skips building a Row per result
+			result = cn.execute(query, params or dict())
+			cursor = result.cursor
+			while True:
+				rows = cursor.fetchmany(chunk_size)
+				if len(rows) == 0:
+					result.close()
+					break
+				chunk = {name: np.array(v, dtype=dtype[name]) for name, v in zip(dtype.names, zip(*rows))}
+				if structured:
+					array = np.empty(len(rows), dtype=dtype)
+					for name, v in chunk.items():
+						array[name] = v
+					yield array
+				else:
+					yield chunk
+
+	def create_indexes(self, indexes=None):
+		# without indexes, builds the indexes deferred by connect
+		if indexes is None:
+			indexes, self.deferred_indexes = self.deferred_indexes, []
 		start_time = time.time()
 		for index in indexes:
-			index.create(bind=self.engine)
+			index_time = time.time()
+			index.create(bind=self.engine, checkfirst=True)
+			print(f'finished creating index {index.name}, took {round(time.time() - index_time, 2)}s.')
 		print(f'finished creating indexes, took {int(time.time() - start_time)}s.')
 	
-	def optimize(self):
+	def optimize(self, max_vacuum_steps=None):
+		'''
+		refresh the statistics, return free pages and truncate the WAL, readers stay online.
+		unlike VACUUM this neither rewrites the file nor blocks writers for more than one step.
+		'''
+		start_time = time.time()
 		with self.engine.connect() as cn:
-			with cn.execution_options(isolation_level='AUTOCOMMIT'):
-				start_time = time.time()
-				cn.execute(text('PRAGMA analysis_limit;'))
-				cn.execute(text('PRAGMA optimize;'))
-				cn.execute(text('VACUUM'))
-				print(f'finished optimizing the database, took {int(time.time() - start_time)}s.')
-	
+			cn = cn.execution_options(isolation_level='AUTOCOMMIT')
+			cn.execute(text(f'PRAGMA analysis_limit={ANALYSIS_LIMIT};'))
+			cn.execute(text('PRAGMA optimize;'))
+		self.incremental_vacuum(max_steps=max_vacuum_steps)
+		self.checkpoint('TRUNCATE')
+		print(f'finished optimizing the database, took {int(time.time() - start_time)}s.')
+
+	def analyze(self, limit=ANALYSIS_LIMIT):
+		# statistics of every index from at most limit rows each
+		start_time = time.time()
+		with self.engine.connect() as cn:
+			cn = cn.execution_options(isolation_level='AUTOCOMMIT')
+			cn.execute(text(f'PRAGMA analysis_limit={limit};'))
+			cn.execute(text('ANALYZE;'))
+		print(f'finished analyzing the database, took {round(time.time() - start_time, 2)}s.')
+
+	def incremental_vacuum(self, pages=VACUUM_PAGES, max_steps=None):
+		'''
+		return free pages to the file system, pages at a time in separate transactions so that
+		writers get in between. requires auto_vacuum=INCREMENTAL, set when the database was created.
+		'''
+		start_time = time.time()
+		freed = 0
+		with self.engine.connect() as cn:
+			cn = cn.execution_options(isolation_level='AUTOCOMMIT')
+			if cn.execute(text('PRAGMA auto_vacuum;')).scalar() != 2:
+				print(f'skipping incremental vacuum, {self.db_path} was not created with auto_vacuum=INCREMENTAL.')
+				return 0
+			steps = 0
+			while max_steps is None or steps < max_steps:
+				free = cn.execute(text('PRAGMA freelist_count;')).scalar()
+				if free == 0:
+					break
+				# executescript steps the pragma to the end, execute would free a single page
+				cn.connection.driver_connection.executescript(f'PRAGMA incremental_vacuum({pages});')
+				freed += min(free, pages)
+				steps += 1
+		print(f'finished freeing {freed} pages, took {round(time.time() - start_time, 2)}s.')
+		return freed
+
+	def wal_size(self):
+		path = self.db_path + '-wal'
+		return os.path.getsize(path) if os.path.exists(path) else 0
+
+	def checkpoint(self, mode=None):
+		'''
+		without a mode, checkpoint only when the WAL is larger than CHECKPOINT_BYTES: PASSIVE,
+		which never waits for readers or writers, or TRUNCATE above TRUNCATE_BYTES, which also
+		resets the file and gives up (busy) when readers are still using it.
+		returns (busy, frames in the WAL, frames checkpointed) or None when not needed.
+		'''
+		size = self.wal_size()
+		if mode is None:
+			if size < CHECKPOINT_BYTES:
+				return None
+			mode = 'TRUNCATE' if size >= TRUNCATE_BYTES else 'PASSIVE'
+		with self.engine.connect() as cn:
+			result = tuple(cn.execute(text(f'PRAGMA wal_checkpoint({mode});')).one())
+		print(f'finished {mode.lower()} checkpoint of {size} bytes of WAL, busy={result[0]}.')
+		return result
+
 	def close(self):
 		self.session.close()
 		self.engine.dispose()
-		print(f'successfully closed {self.db_path}.')
\ No newline at end of file
+		self.readers.dispose()
+		print(f'successfully closed {self.db_path}.')
+
+class AsyncSQLite:
+	'''
+	asyncio front-end of SQLite for services, calls run on a small executor so the event loop never blocks.
+	connections, pragma profiles and the read-only pool are those of the wrapped SQLite instance:
+	queries and streams use the reader pool, writes the writer engine.
+	'''
+
+	def __init__(self, db_path, read_only=True, pool_size=NUM_READERS, **kwargs):
+		self.db = SQLite(db_path, read_only=read_only, num_readers=pool_size, **kwargs)
+		# one thread per pooled reader plus one for writes
+		self.executor = ThreadPoolExecutor(max_workers=pool_size + 1)
+
+	async def _run(self, f, *args, **kwargs):
+		return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(f, *args, **kwargs))
+
+	async def connect(self, base):
+		await self._run(self.db.connect, base)
+
+	async def query(self, query, params=None):
+		# all rows of a select (sql text or selectable)
+		return await self._run(self.db._read, query, params)
+
+	async def execute(self, query, params=None):
+		# a statement in its own transaction on the writer engine, returns the number of rows changed
+		def execute():
+			with self.db.engine.begin() as cn:
+				return cn.execute(_to_query(query), params or dict()).rowcount
+		return await self._run(execute)
+
+	async def bulk_insert(self, entity, rows, chunk_size=100000, upsert=False):
+		return await self._run(self.db.bulk_insert, entity, rows, chunk_size=chunk_size, upsert=upsert)
+
+	async def stream(self, query, params=None, batch_size=1000):
+		# iterate over the rows of a select, fetching batch_size rows at a time on the executor
+		cn = await self._run(self.db._readers().connect)
+		try:
+			result = await self._run(cn.execute, _to_query(query), params or dict())
+			while True:
+				rows = await self._run(result.fetchmany, batch_size)
+				if len(rows) == 0:
+					break
+				for row in rows:
+					yield row
+		finally:
+			await self._run(cn.close)
+
+	async def close(self):
+		await self._run(self.db.close)
+		self.executor.shutdown()
@@ -0,0 +1,88 @@
+import time
+from sqlalchemy import insert, select, text
+
+from entities_ana import DictionaryCode
+
+# decoded views are named <table>_view
+VIEW_POSTFIX = '_view'
+
+def coded_columns(table):
+	# keys of the columns stored as dictionary codes
+	return [c.key for c in table.columns if c.info.get('dictionary')]
+
+def dictionary_name(table, column):
+	return f'{table.name}.{column}'
+
+class Encoder:
+	'''
+	codes of the text values of coded columns, all dictionaries are cached in memory.
+	a new value gets the next code of its dictionary and is written to dictionary_codes
+	before any row using it is yielded.
+	'''
+
+	def __init__(self, db):
+		self.db = db
+		self.codes = dict()
+		self.values = dict()
+		with db.engine.connect() as cn:
+			for dictionary, code, value in cn.execute(select(DictionaryCode.dictionary, DictionaryCode.code, DictionaryCode.value)):
+				self.codes.setdefault(dictionary, dict())[value] = code
+				self.values.setdefault(dictionary, dict())[code] = value
+
+	def encode(self, table, rows):
+		# rows (dicts) with the values of coded columns replaced by their codes, None stays None
+		columns = [(c, dictionary_name(table, c)) for c in coded_columns(table)]
+		for row in rows:
+			for c, dictionary in columns:
+				value = row.get(c)
+				if value is not None:
+					row[c] = self.code(dictionary, value)
+			yield row
+
+	def code(self, dictionary, value):
+		codes = self.codes.setdefault(dictionary, dict())
+		code = codes.get(value)
+		if code is None:
+			values = self.values.setdefault(dictionary, dict())
+			code = max(values.keys(), default=0) + 1
+			with self.db.engine.begin() as cn:
+				cn.execute(insert(DictionaryCode.__table__), {'dictionary': dictionary, 'code': code, 'value': value})
+			codes[value] = code
+			values[code] = value
+		return code
+
+	def decode(self, dictionary, code):
+		return self.values.get(dictionary, dict()).get(code)
+
+def decoded_select(table):
+	# select of the columns of table with the codes replaced by their values, None without coded columns
+	coded = coded_columns(table)
+	if len(coded) == 0:
+		return None
+	columns = []
+	joins = []
+	for c in table.columns:
+		if c.key in coded:
+			alias = f'd_{c.key}'
+			columns.append(f'{alias}.value AS {c.key}')
+			joins.append(f"LEFT JOIN {DictionaryCode.__tablename__} {alias} " + \
+				f"ON {alias}.dictionary = '{dictionary_name(table, c.key)}' AND {alias}.code = t.{c.key}")
+		else:
+			columns.append(f't.{c.key}')
+	return f'SELECT {", ".join(columns)} FROM {table.name} t {" ".join(joins)}'
+
+def install_views(db, base):
+	'''
+	one view per table with coded columns, e.g. wt_communication_history_view,
+	with the same columns as the table and the codes replaced by their values.
+	'''
+	start_time = time.time()
+	with db.engine.begin() as cn:
+		for table in base.metadata.sorted_tables:
+			select = decoded_select(table)
+			if select is None:
+				continue
+			view = table.name + VIEW_POSTFIX
+			cn.execute(text(f'DROP VIEW IF EXISTS {view}'))
+			cn.execute(text(f'CREATE VIEW {view} AS {select}'))
+	print(f'finished installing dictionary views, took {int(time.time() - start_time)}s.')
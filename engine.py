@@ -0,0 +1,195 @@
+from datetime import datetime
+import numpy as np
+
+from entities import Activity, Application, TargetPopulation, Visitor
+import utils
+
+# applied: visitor submitted application
+# decision: approved or rejected based on visitor soft-pull credit info
+# offered: customer prices offered if approved
+# accepted: custom prices accepted by customer
+# hard-pull: final verification
+# converted: successfully converted
+# cancelled: application cancelled
+STATUSES = np.array(['applied', 'approved', 'rejected', 'offered', 'accepted', 'hard-pull', 'converted', 'cancelled'])
+APPLIED, APPROVED, REJECTED, OFFERED, ACCEPTED, HARD_PULL, CONVERTED, CANCELLED = range(len(STATUSES))
+
+# status of each stage of the chain, the decision stage is resolved per application
+STAGES = np.array([APPLIED, APPROVED, OFFERED, ACCEPTED, HARD_PULL, CONVERTED])
+
+MAX_CLICKS = 5
+BATCH_SIZE = 100000 # visitors per batch of the streaming pipeline
+VISITOR_ID = ('V', 8)
+ACTIVITY_ID = ('AC', 8)
+APPLICATION_ID = ('AP', 6)
+START_DT = np.datetime64(datetime(2024, 1, 1), 's')
+DAY = np.timedelta64(1, 'D')
+
+def segment_starts(counts):
+	# index of the first element of each element's segment
+	return np.repeat(np.cumsum(counts) - counts, counts)
+
+def segment_cumsum(values, starts):
+	# cumulative sum that restarts at each segment
+	total = np.cumsum(values)
+	return total - total[starts] + values[starts]
+
+def simulate_targets(rng, visitors, num_campaigns, num_visitors):
+	'''
+	one row per campaign and visitor, campaign-major as the original loop.
+	visitors are visitor indices, num_visitors is the total number of visitors
+	so that offer numbers do not depend on how visitors are batched.
+	'''
+	visitors = np.asarray(visitors)
+	campaign = np.repeat(np.arange(num_campaigns), len(visitors))
+	visitor = np.tile(visitors, num_campaigns)
+	n = len(visitor)
+	offer = campaign * num_visitors + visitor
+	offer[rng.random(n) < 0.5] = -1
+	return {
+		'visitor': visitor,
+		'campaign': campaign,
+		'offer': offer,
+		'resp_prob': rng.uniform(0, 0.2, n).round(utils.DECIMAL),
+		'conv_prob': rng.uniform(0, 0.05, n).round(utils.DECIMAL),
+		'cus_value': rng.uniform(100, 1000, n).round(utils.DECIMAL),
+		'expected_approval_rate': rng.uniform(0.3, 0.7, n).round(utils.DECIMAL),
+	}
+
+def simulate_funnel(rng, targets):
+	'''
+	simulate clicks and application status chains for all targets at once.
+	returns activities and applications as dicts of arrays, where target is
+	the row index into targets.
+	'''
+	n = len(targets['visitor'])
+	num_stages = len(STAGES)
+
+	# clicks per target, each click is some days after the previous event
+	clicks = rng.integers(0, MAX_CLICKS + 1, n)
+	target = np.repeat(np.arange(n), clicks)
+	starts = segment_starts(clicks)
+	m = len(target)
+	gap = rng.integers(1, 6, m)
+
+	# a click may lead to an application
+	submitted = rng.random(m) <= utils.SUBMISSION_PROB
+	k = int(submitted.sum())
+	approved = rng.random(k) <= utils.APPROVE_REJECT_PROB
+	cancelled = rng.random((k, num_stages)) <= utils.CANCEL_PROB
+	cancelled[:, 0] = False
+	status = np.tile(STAGES, (k, 1))
+	status[:, 1] = np.where(approved, APPROVED, REJECTED)
+	status[cancelled] = CANCELLED
+
+	# the chain stops at the first cancelled or rejected status
+	terminal = status == CANCELLED
+	terminal[:, 1] |= ~approved
+	length = np.where(terminal.any(axis=1), terminal.argmax(axis=1) + 1, num_stages)
+	in_chain = np.arange(num_stages) < length[:, None]
+	status_gap = rng.integers(1, 4, (k, num_stages)) * in_chain
+	status_offset = np.cumsum(status_gap, axis=1)
+
+	# days spent in the application of each click
+	duration = np.zeros(m, dtype=np.int64)
+	duration[submitted] = status_offset[:, -1]
+	converted = np.zeros(m, dtype=bool)
+	converted[submitted] = status[np.arange(k), length - 1] == CONVERTED
+
+	# the next click happens after the previous click's application
+	step = gap.copy()
+	step[1:] += np.where(target[1:] == target[:-1], duration[:-1], 0)
+	offset = segment_cumsum(step, starts)
+
+	# no more activity after a conversion
+	converted_before = segment_cumsum(converted.astype(np.int64), starts) - converted
+	keep = converted_before == 0
+
+	activities = {
+		'target': target[keep],
+		'clicked_dt': START_DT + offset[keep] * DAY,
+	}
+
+	keep_app = keep[submitted]
+	click_offset = offset[submitted][keep_app]
+	in_chain = in_chain[keep_app]
+	app, stage = np.nonzero(in_chain)
+	applications = {
+		'target': target[submitted][keep_app][app],
+		'application': app,
+		'status': status[keep_app][app, stage],
+		'status_dt': START_DT + (click_offset[app] + status_offset[keep_app][app, stage]) * DAY,
+	}
+	return activities, applications
+
+def format_ids(prefix, width, numbers):
+	return [f'{prefix}{str(i).zfill(width)}' for i in numbers.tolist()]
+
+def visitor_ids(visitors):
+	# visitor index to visitor id
+	return dict(zip(visitors.tolist(), format_ids(*VISITOR_ID, visitors)))
+
+def to_datetimes(values):
+	return values.astype('datetime64[us]').tolist()
+
+def target_rows(targets, visitor_ids, campaign_ids):
+	# rows in TargetPopulation column order
+	offers = ['' if o < 0 else f'O{str(o).zfill(3)}' for o in targets['offer'].tolist()]
+	return zip(
+		[campaign_ids[c] for c in targets['campaign'].tolist()],
+		[visitor_ids[v] for v in targets['visitor'].tolist()],
+		offers,
+		targets['resp_prob'].tolist(),
+		targets['conv_prob'].tolist(),
+		targets['cus_value'].tolist(),
+		[True] * len(offers),
+		targets['expected_approval_rate'].tolist(),
+		[None] * len(offers),
+		[None] * len(offers),
+	)
+
+def activity_rows(activities, targets, visitor_ids, campaign_ids, channel_ids, first_id=0):
+	# rows in Activity column order
+	target = activities['target']
+	campaign = targets['campaign'][target].tolist()
+	return zip(
+		format_ids(*ACTIVITY_ID, np.arange(first_id, first_id + len(target))),
+		[visitor_ids[v] for v in targets['visitor'][target].tolist()],
+		to_datetimes(activities['clicked_dt']),
+		[campaign_ids[c] for c in campaign],
+		[channel_ids[c] for c in campaign],
+	)
+
+def application_rows(applications, targets, visitor_ids, campaign_ids, first_id=0):
+	# rows in Application column order
+	target = applications['target']
+	status = applications['status']
+	return zip(
+		format_ids(*APPLICATION_ID, applications['application'] + first_id),
+		to_datetimes(applications['status_dt']),
+		STATUSES[status].tolist(),
+		[visitor_ids[v] for v in targets['visitor'][target].tolist()],
+		(status == CONVERTED).tolist(),
+		[campaign_ids[c] for c in targets['campaign'][target].tolist()],
+	)
+
+def simulate_stream(rng, start, stop, num_visitors, campaign_ids, channel_ids, customers, batch_size=BATCH_SIZE):
+	'''
+	generator of (entity, rows) for visitors in [start, stop), one visitor batch at a time,
+	so memory is bounded by batch_size no matter how many visitors are simulated.
+	customers maps visitor indices to customer ids.
+	'''
+	next_activity = 0
+	next_application = 0
+	for batch_start in range(start, stop, batch_size):
+		visitors = np.arange(batch_start, min(batch_start + batch_size, stop))
+		ids = visitor_ids(visitors)
+		targets = simulate_targets(rng, visitors, len(campaign_ids), num_visitors)
+		activities, applications = simulate_funnel(rng, targets)
+		yield Visitor, ((ids[v], customers.get(v)) for v in visitors.tolist())
+		yield TargetPopulation, target_rows(targets, ids, campaign_ids)
+		yield Activity, activity_rows(activities, targets, ids, campaign_ids, channel_ids, next_activity)
+		yield Application, application_rows(applications, targets, ids, campaign_ids, next_application)
+		next_activity += len(activities['target'])
+		if len(applications['application']) > 0:
+			next_application += int(applications['application'][-1]) + 1
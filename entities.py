@@ -2,7 +2,7 @@ from sqlalchemy import ForeignKey, DateTime
 from sqlalchemy.orm import DeclarativeBase, relationship, Mapped, mapped_column
 from sqlalchemy.sql import func
 from typing import List
-from datetime import datetime
+from datetime import datetime, date
 
 import utils
 
@@ -43,6 +43,70 @@ class Application(Base):
     def __repr__(self):
         return f'ap_{self.application_id}_{self.status_dt.strftime(utils.DATETIME_FORMAT)}'
 
+class ClickAttribution(Base):
+
+    # credit of each click for a converted application, maintained by attribution.py
+    __tablename__ = 'click_attribution'
+
+    model: Mapped[str] = mapped_column(primary_key=True) # position_based, time_decay or last_click
+    application_id: Mapped[str] = mapped_column(primary_key=True)
+    activity_id: Mapped[str] = mapped_column(ForeignKey('activities.activity_id'), primary_key=True)
+    visitor_id: Mapped[str] = mapped_column(ForeignKey('visitors.visitor_id'))
+    campaign_id: Mapped[str] = mapped_column(ForeignKey('campaigns.campaign_id'))
+    channel_id: Mapped[str] = mapped_column(ForeignKey('channels.channel_id'))
+    credit: Mapped[float] = mapped_column(default=0.0)
+
+    def __repr__(self):
+        return f'ca_{self.model}_{self.application_id}_{self.activity_id}'
+
+class ApplicationCurrentState(Base):
+
+    # maintained by current_state.py, latest status of each application
+    __tablename__ = 'application_current_state'
+
+    application_id: Mapped[str] = mapped_column(primary_key=True)
+    status: Mapped[str] = mapped_column()
+    status_dt: Mapped[datetime] = mapped_column()
+    visitor_id: Mapped[str] = mapped_column()
+    campaign_id: Mapped[str] = mapped_column()
+
+    def __repr__(self):
+        return f'acs_{self.application_id}'
+
+class FunnelSummary(Base):
+
+    # maintained by funnel.py, one row per campaign, channel and application week
+    __tablename__ = 'funnel_summary'
+
+    campaign_id: Mapped[str] = mapped_column(primary_key=True)
+    channel_id: Mapped[str] = mapped_column(primary_key=True)
+    week: Mapped[date] = mapped_column(primary_key=True) # monday of the week the application was submitted
+
+    # number of applications that reached each status
+    applied: Mapped[int] = mapped_column(default=0)
+    approved: Mapped[int] = mapped_column(default=0)
+    rejected: Mapped[int] = mapped_column(default=0)
+    offered: Mapped[int] = mapped_column(default=0)
+    accepted: Mapped[int] = mapped_column(default=0)
+    hard_pull: Mapped[int] = mapped_column(default=0)
+    converted: Mapped[int] = mapped_column(default=0)
+    cancelled: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self):
+        return f'fs_{self.campaign_id}_{self.channel_id}_{self.week.strftime(utils.DATE_FORMAT)}'
+
+class FunnelCohort(Base):
+
+    # maintained by funnel.py, the week funnel_summary counts an application in
+    __tablename__ = 'funnel_cohorts'
+
+    application_id: Mapped[str] = mapped_column(primary_key=True)
+    first_dt: Mapped[datetime] = mapped_column() # earliest status_dt loaded so far
+    week: Mapped[date] = mapped_column() # monday of the week of first_dt
+
+    def __repr__(self):
+        return f'fc_{self.application_id}'
+
 # eligibility table?
 class TargetPopulation(Base):
 
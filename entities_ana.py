@@ -1,4 +1,4 @@
-from sqlalchemy import ForeignKey, DateTime
+from sqlalchemy import ForeignKey, DateTime, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, relationship, Mapped, mapped_column
 from sqlalchemy.sql import func
 from typing import List
@@ -15,6 +15,10 @@ import utils
 # is there a table to tie visitor to cardmember or DPL customer?
 # difficult for onmichannel view
 
+# low-cardinality text stored as integer codes of dictionary_codes, encoded by loader.py
+# and decoded by the <table>_view views of dictionary.py
+CODED = {'dictionary': True}
+
 class Base(DeclarativeBase):
     
     def __eq__(self, other):
@@ -75,6 +79,38 @@ class SolicitedHistory(Base):
     # what is this?
     wt_elig: Mapped[str] = mapped_column()
 
+class SolicitedWeek(Base):
+
+    # long format of solicited_history, the columns that are not per channel
+    __tablename__ = 'solicited_weeks'
+
+    cims_acct_key: Mapped[int] = mapped_column(
+        ForeignKey('cardmembers.cims_acct_key'), 
+        primary_key=True,
+        comment='Acct key for Card Members'
+    )
+    perf_week: Mapped[date] = mapped_column(primary_key=True)
+    wt_elig: Mapped[str] = mapped_column()
+
+class SolicitedOffer(Base):
+
+    # long format of solicited_history, one row per channel with an offer
+    __tablename__ = 'solicited_offers'
+
+    cims_acct_key: Mapped[int] = mapped_column(
+        ForeignKey('cardmembers.cims_acct_key'), 
+        primary_key=True,
+        comment='Acct key for Card Members'
+    )
+    perf_week: Mapped[date] = mapped_column(primary_key=True)
+    channel: Mapped[str] = mapped_column(
+        primary_key=True,
+        comment='dm, email or wt'
+    )
+    offer_id: Mapped[str] = mapped_column(index=True)
+    offer_strt_dt: Mapped[date] = mapped_column(nullable=True)
+    offer_end_dt: Mapped[date] = mapped_column(nullable=True)
+
 class ModelScoreHistory(Base):
 
     __tablename__ = 'model_score_history'
@@ -148,8 +184,9 @@ class DMCommunicationHistory(Base):
         comment='Unica source code of the campaign (distinct campaign id)'
     )
     week: Mapped[int] = mapped_column()
-    description: Mapped[str] = mapped_column(
+    description: Mapped[int] = mapped_column(
         nullable=True, 
+        info=CODED,
         comment='Creative description'
     )
 
@@ -167,8 +204,9 @@ class EmailCommunicationHistory(Base):
         primary_key=True, 
         comment='Email delivery date'
     )
-    day_part: Mapped[str] = mapped_column(
+    day_part: Mapped[int] = mapped_column(
         primary_key=True,
+        info=CODED,
         comment='Time of Day email was delivered'
     )
     email_offer_id: Mapped[str] = mapped_column(
@@ -176,8 +214,8 @@ class EmailCommunicationHistory(Base):
     )
     email_mail_cmpgn_nm: Mapped[str] = mapped_column(nullable=True)
     email_offr_srcde: Mapped[str] = mapped_column(nullable=True)
-    email_campg_group: Mapped[str] = mapped_column(nullable=True)
-    description: Mapped[str] = mapped_column(nullable=True)
+    email_campg_group: Mapped[int] = mapped_column(nullable=True, info=CODED)
+    description: Mapped[int] = mapped_column(nullable=True, info=CODED)
 
 class WTCommunicationHistory(Base):
 
@@ -192,26 +230,31 @@ class WTCommunicationHistory(Base):
         primary_key=True,
         comment='Date of Impression'
     )
-    page_name: Mapped[str] = mapped_column(
+    page_name: Mapped[int] = mapped_column(
         primary_key=True,
+        info=CODED,
         comment='Page of impression'
     )
     wt_offer_id: Mapped[str] = mapped_column(primary_key=True)
     # what is this?
-    area_nm: Mapped[str] = mapped_column(
+    area_nm: Mapped[int] = mapped_column(
         nullable=True,
+        info=CODED,
         comment='Name of module'
     )
-    cont_nm: Mapped[str] = mapped_column(
+    cont_nm: Mapped[int] = mapped_column(
         nullable=True,
+        info=CODED,
         comment='Description of impression content'
     ) 
-    usr_os: Mapped[str] = mapped_column(
+    usr_os: Mapped[int] = mapped_column(
         nullable=True,
+        info=CODED,
         comment='Operating System'
     )
-    dev_type: Mapped[str] = mapped_column(
+    dev_type: Mapped[int] = mapped_column(
         nullable=True,
+        info=CODED,
         comment='Device Type'
     )
 
@@ -338,6 +381,60 @@ class ExternalVariables(Base):
     cpi: Mapped[float] = mapped_column(nullable=True)
     inflation: Mapped[float] = mapped_column(nullable=True)
 
+class ResponseAttribution(Base):
+
+    # credit of communications for each response, maintained by response_attribution.py
+    # a response is a row of responder_history, the key columns are the same
+    __tablename__ = 'response_attribution'
+
+    rule: Mapped[str] = mapped_column(
+        primary_key=True,
+        comment='last_touch, first_touch or linear'
+    )
+    bnk_acct_key: Mapped[int] = mapped_column(primary_key=True)
+    cims_acct_key: Mapped[int] = mapped_column(
+        ForeignKey('cardmembers.cims_acct_key'),
+        primary_key=True
+    )
+    mstr_apln_id: Mapped[int] = mapped_column(primary_key=True)
+    email_dlvy_dt: Mapped[date] = mapped_column(primary_key=True)
+    touch_seq: Mapped[int] = mapped_column(
+        primary_key=True,
+        comment='order of the touch within the lookback window'
+    )
+    channel: Mapped[str] = mapped_column(comment='dm, email or wt')
+    touch_dt: Mapped[date] = mapped_column()
+    offer_id: Mapped[str] = mapped_column(nullable=True)
+    credit: Mapped[float] = mapped_column(default=0.0)
+    source_match: Mapped[bool] = mapped_column(
+        default=False,
+        comment='the touch is the source code and date recorded in responder_history'
+    )
+
+class DictionaryCode(Base):
+
+    # codes of the CODED columns, one dictionary per <table>.<column>, maintained by dictionary.py
+    __tablename__ = 'dictionary_codes'
+    __table_args__ = (UniqueConstraint('dictionary', 'value'),)
+
+    dictionary: Mapped[str] = mapped_column(primary_key=True)
+    code: Mapped[int] = mapped_column(primary_key=True)
+    value: Mapped[str] = mapped_column()
+
+class LoadWatermark(Base):
+
+    # what has been loaded per table and period, maintained by loader.py
+    __tablename__ = 'load_watermarks'
+
+    table_name: Mapped[str] = mapped_column(primary_key=True)
+    period: Mapped[date] = mapped_column(primary_key=True)
+    row_count: Mapped[int] = mapped_column(default=0)
+    checksum: Mapped[int] = mapped_column(
+        default=0,
+        comment='order independent checksum of the rows of the period'
+    )
+    loaded_at: Mapped[datetime] = mapped_column()
+
 # class Visitor(Base):
 
 #     __tablename__ = 'visitors'
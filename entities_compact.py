@@ -0,0 +1,162 @@
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from datetime import datetime
+
+import utils
+
+# compact-key variant of entities.py: integer surrogate keys everywhere, the external
+# string ids only live in the dimension tables (or application_keys) and are mapped by keys.py.
+# composite-key tables are stored without rowid, so the primary key is the table itself.
+
+WITHOUT_ROWID = {'sqlite_with_rowid': False}
+
+class Base(DeclarativeBase):
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+class Activity(Base):
+
+    __tablename__ = 'activities'
+
+    activity_key: Mapped[int] = mapped_column(primary_key=True)
+    activity_id: Mapped[str] = mapped_column(unique=True)
+    visitor_key: Mapped[int] = mapped_column(ForeignKey('visitors.visitor_key'), index=True)
+    clicked_dt: Mapped[datetime] = mapped_column()
+    clicked_campaign_key: Mapped[int] = mapped_column(ForeignKey('campaigns.campaign_key'), index=True)
+    clicked_channel_key: Mapped[int] = mapped_column(ForeignKey('channels.channel_key'), index=True)
+
+    def __repr__(self):
+        return f'ac_{self.activity_key}'
+
+class ApplicationKey(Base):
+
+    # applications have no dimension table, this is the dictionary of their ids
+    __tablename__ = 'application_keys'
+
+    application_key: Mapped[int] = mapped_column(primary_key=True)
+    application_id: Mapped[str] = mapped_column(unique=True)
+
+    def __repr__(self):
+        return f'apk_{self.application_key}'
+
+class Application(Base):
+
+    __tablename__ = 'applications'
+    __table_args__ = WITHOUT_ROWID
+
+    application_key: Mapped[int] = mapped_column(ForeignKey('application_keys.application_key'), primary_key=True)
+    status_dt: Mapped[datetime] = mapped_column(primary_key=True)
+    status: Mapped[str] = mapped_column()
+    visitor_key: Mapped[int] = mapped_column(ForeignKey('visitors.visitor_key'))
+    conversion_flag: Mapped[bool] = mapped_column(default=False)
+    campaign_key: Mapped[int] = mapped_column(ForeignKey('campaigns.campaign_key'))
+
+    def __repr__(self):
+        return f'ap_{self.application_key}_{self.status_dt.strftime(utils.DATETIME_FORMAT)}'
+
+class TargetPopulation(Base):
+
+    __tablename__ = 'target_population'
+    __table_args__ = WITHOUT_ROWID
+
+    campaign_key: Mapped[int] = mapped_column(ForeignKey('campaigns.campaign_key'), primary_key=True)
+    visitor_key: Mapped[int] = mapped_column(ForeignKey('visitors.visitor_key'), primary_key=True)
+    offer_id: Mapped[str] = mapped_column()
+    resp_prob: Mapped[float] = mapped_column(default=0.0)
+    conv_prob: Mapped[float] = mapped_column(default=0.0)
+    cus_value: Mapped[float] = mapped_column(default=0.0)
+    eligibility_flag: Mapped[bool] = mapped_column(default=False)
+    expected_approval_rate: Mapped[float] = mapped_column(default=0.0)
+    valid_from: Mapped[datetime] = mapped_column(nullable=True)
+    valid_to: Mapped[datetime] = mapped_column(nullable=True)
+
+    def __repr__(self):
+        return f'tp_{self.visitor_key}_{self.campaign_key}'
+
+class MarketingSpend(Base):
+
+    __tablename__ = 'marketing_spend'
+    __table_args__ = WITHOUT_ROWID
+
+    campaign_key: Mapped[int] = mapped_column(ForeignKey('campaigns.campaign_key'), primary_key=True)
+    start_dt: Mapped[datetime] = mapped_column(primary_key=True)
+    end_dt: Mapped[datetime] = mapped_column(primary_key=True)
+    channel_spend: Mapped[float] = mapped_column(default=0.0)
+    campaign_spend: Mapped[float] = mapped_column(default=0.0)
+
+    def __repr__(self):
+        return f'ms_{self.campaign_key}_' + \
+            f'{self.start_dt.strftime(utils.DATETIME_FORMAT)}_' + \
+            f'{self.end_dt.strftime(utils.DATETIME_FORMAT)}'
+
+class Channel(Base):
+
+    __tablename__ = 'channels'
+
+    channel_key: Mapped[int] = mapped_column(primary_key=True)
+    channel_id: Mapped[str] = mapped_column(unique=True)
+    channel_name: Mapped[str] = mapped_column(default='')
+
+    def __repr__(self):
+        return f'h_{self.channel_key}'
+
+class Campaign(Base):
+
+    __tablename__ = 'campaigns'
+
+    campaign_key: Mapped[int] = mapped_column(primary_key=True)
+    campaign_id: Mapped[str] = mapped_column(unique=True)
+    campaign_name: Mapped[str] = mapped_column(default='')
+    channel_key: Mapped[int] = mapped_column(ForeignKey('channels.channel_key'))
+    product_key: Mapped[int] = mapped_column(ForeignKey('products.product_key'))
+
+    def __repr__(self):
+        return f'c_{self.campaign_key}'
+
+class Visitor(Base):
+
+    __tablename__ = 'visitors'
+
+    visitor_key: Mapped[int] = mapped_column(primary_key=True)
+    visitor_id: Mapped[str] = mapped_column(unique=True)
+    customer_key: Mapped[int] = mapped_column(ForeignKey('customers.customer_key'), nullable=True)
+
+    def __repr__(self):
+        return f'v_{self.visitor_key}'
+
+class Customer(Base):
+
+    __tablename__ = 'customers'
+
+    customer_key: Mapped[int] = mapped_column(primary_key=True)
+    customer_id: Mapped[str] = mapped_column(unique=True)
+    card_member_ind: Mapped[bool] = mapped_column()
+    dpl_ind: Mapped[bool] = mapped_column()
+
+    def __repr__(self):
+        return f'u_{self.customer_key}'
+
+class Product(Base):
+
+    __tablename__ = 'products'
+
+    product_key: Mapped[int] = mapped_column(primary_key=True)
+    product_id: Mapped[str] = mapped_column(unique=True)
+    product_name: Mapped[str] = mapped_column()
+    headline_rate_lb: Mapped[float] = mapped_column(default=0)
+    headline_rate_ub: Mapped[float] = mapped_column(default=0)
+
+class CustomerProducts(Base):
+
+    __tablename__ = 'customer_products'
+    __table_args__ = WITHOUT_ROWID
+
+    customer_key: Mapped[int] = mapped_column(ForeignKey('customers.customer_key'), primary_key=True)
+    product_key: Mapped[int] = mapped_column(ForeignKey('products.product_key'), primary_key=True)
+    status: Mapped[str] = mapped_column()
+    start_dt: Mapped[datetime] = mapped_column()
+    end_dt: Mapped[datetime] = mapped_column()
@@ -0,0 +1,148 @@
+from datetime import date
+from itertools import groupby
+import json
+from operator import itemgetter
+import os
+import time
+import numpy as np
+from sqlalchemy import text
+
+import asof
+
+# numeric features taken as of each week
+PROFILE_COLUMNS = ['mob', 'fico', 'otb', 'eighteen_mnth_score']
+SCORE_COLUMNS = ['rsp_mdl_scr', 'em_channel_pref_scr', 'dpl_email_clk_scr', 'wt_alloc_mdl_scr']
+FLAG_COLUMNS = ['risk_elig', 'sls_actv_pgm_eligble_ind']
+EXTERNAL_COLUMNS = ['unemployment_rate', 'fed_rate', 'cpi', 'inflation']
+
+# eligibility values encoded as 1, any other value as 0, missing as nan
+ELIGIBLE_VALUES = {'Y', 'YES', '1', 'TRUE', 'ELIGIBLE'}
+
+# communications counted over trailing windows of weeks ending at each week
+COMMUNICATION_TABLES = {
+	'dm': ('dm_communication_history', 'mail_drop_dt'),
+	'email': ('email_communication_history', 'email_dlvy_dt'),
+	'wt': ('wt_communication_history', 'wt_date'),
+}
+WINDOWS = [4, 13]
+
+# accounts of each week
+ACCOUNT_QUERY = 'SELECT cims_acct_key FROM cardmembers UNION SELECT cims_acct_key FROM cardmember_profiles'
+
+DTYPE = np.float32
+MANIFEST = 'manifest.json'
+KEYS = 'keys.bin'
+FEATURES = 'features.bin'
+
+def columns():
+	counts = [f'{c}_count_{w}w' for c in COMMUNICATION_TABLES.keys() for w in WINDOWS]
+	return PROFILE_COLUMNS + SCORE_COLUMNS + FLAG_COLUMNS + EXTERNAL_COLUMNS + counts
+
+def append(db, directory, weeks):
+	'''
+	materialize the feature rows of each week that is not in the store yet and append them
+	to the end of the files, history is never rewritten. rows are (cims_acct_key, perf_week)
+	in keys.bin and float32 features in features.bin, described by manifest.json.
+	'''
+	os.makedirs(directory, exist_ok=True)
+	manifest = read_manifest(directory)
+	if manifest['columns'] != columns():
+		raise ValueError(f'{directory} was built with different columns, please rebuild it.')
+	_truncate(directory, manifest)
+	for week in sorted(set(weeks)):
+		week = date.fromisoformat(str(week))
+		if str(week) in manifest['weeks']:
+			print(f'skipping {week}, already in {directory}.')
+			continue
+		start_time = time.time()
+		keys, features = build_week(db, week)
+		with open(os.path.join(directory, KEYS), 'ab') as f:
+			f.write(keys.tobytes())
+		with open(os.path.join(directory, FEATURES), 'ab') as f:
+			f.write(features.tobytes())
+		manifest['weeks'][str(week)] = [manifest['rows'], manifest['rows'] + len(keys)]
+		manifest['rows'] += len(keys)
+		# the manifest is written last, rows beyond it are dropped by the next append
+		write_manifest(directory, manifest)
+		print(f'finished appending {len(keys)} rows for {week}, took {int(time.time() - start_time)}s.')
+	return manifest
+
+def build_week(db, week):
+	with db.engine.connect() as cn:
+		accounts = np.array([r[0] for r in cn.execute(text(ACCOUNT_QUERY))], dtype=np.int64)
+	n = len(accounts)
+	joined = asof.asof_join(db, accounts, np.full(n, np.datetime64(week, 'D')))
+	features = np.empty((n, len(columns())), dtype=DTYPE)
+	i = 0
+	for c in PROFILE_COLUMNS + SCORE_COLUMNS:
+		features[:, i] = joined[c]
+		i += 1
+	for c in FLAG_COLUMNS:
+		values = joined[c]
+		features[:, i] = [np.nan if v is None else float(str(v).strip().upper() in ELIGIBLE_VALUES) for v in values]
+		i += 1
+	for c in EXTERNAL_COLUMNS:
+		features[:, i] = joined[c]
+		i += 1
+	for table, column in COMMUNICATION_TABLES.values():
+		for w in WINDOWS:
+			features[:, i] = communication_counts(db, table, column, accounts, week, w)
+			i += 1
+	keys = np.empty((n, 2), dtype=np.int64)
+	keys[:, 0] = accounts
+	keys[:, 1] = np.datetime64(week, 'D').astype(np.int64)
+	return keys, features
+
+def communication_counts(db, table, column, accounts, week, weeks):
+	# communications per account in (week - weeks, week]
+	lo = np.datetime64(week, 'D') - np.timedelta64(7 * weeks, 'D')
+	query = text(f'SELECT cims_acct_key, count(*) FROM {table} WHERE {column} > :lo AND {column} <= :hi ' + \
+		'GROUP BY cims_acct_key ORDER BY cims_acct_key')
+	# the counts of the partitions of a partitions.PartitionedStore are merged by account and summed
+	rows = db.stream_rows(table, query, {'lo': str(lo), 'hi': str(week)}, start=str(lo), end=str(week), key=itemgetter(0))
+	rows = [(k, sum(c for _, c in group)) for k, group in groupby(rows, key=itemgetter(0))]
+	counts = np.zeros(len(accounts), dtype=DTYPE)
+	if len(rows) > 0:
+		keys, values = map(np.array, zip(*rows))
+		index = np.minimum(np.searchsorted(keys, accounts), len(keys) - 1)
+		hit = keys[index] == accounts
+		counts[hit] = values[index[hit]]
+	return counts
+
+def open_matrix(directory, week=None):
+	'''
+	memory-mapped (keys, features, manifest) without copying, optionally limited to one week.
+	keys are (cims_acct_key, days since 1970-01-01 of perf_week).
+	'''
+	manifest = read_manifest(directory)
+	rows = manifest['rows']
+	if rows == 0:
+		return np.empty((0, 2), dtype=np.int64), np.empty((0, len(manifest['columns'])), dtype=DTYPE), manifest
+	keys = np.memmap(os.path.join(directory, KEYS), dtype=np.int64, mode='r', shape=(rows, 2))
+	features = np.memmap(os.path.join(directory, FEATURES), dtype=manifest['dtype'], mode='r',
+		shape=(rows, len(manifest['columns'])))
+	if week is not None:
+		start, stop = manifest['weeks'][str(week)]
+		keys, features = keys[start:stop], features[start:stop]
+	return keys, features, manifest
+
+def read_manifest(directory):
+	path = os.path.join(directory, MANIFEST)
+	if not os.path.exists(path):
+		return {'columns': columns(), 'dtype': np.dtype(DTYPE).name, 'rows': 0, 'weeks': dict()}
+	with open(path) as f:
+		return json.load(f)
+
+def write_manifest(directory, manifest):
+	path = os.path.join(directory, MANIFEST)
+	with open(path + '.tmp', 'w') as f:
+		json.dump(manifest, f, indent=1)
+	os.replace(path + '.tmp', path)
+
+def _truncate(directory, manifest):
+	# drop rows of an append that did not finish
+	for name, width in [(KEYS, 2 * np.dtype(np.int64).itemsize), (FEATURES, len(manifest['columns']) * np.dtype(DTYPE).itemsize)]:
+		path = os.path.join(directory, name)
+		if os.path.exists(path) and os.path.getsize(path) > manifest['rows'] * width:
+			with open(path, 'r+b') as f:
+				f.truncate(manifest['rows'] * width)
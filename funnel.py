@@ -0,0 +1,118 @@
+import time
+from sqlalchemy import select, text
+
+from entities import FunnelSummary
+import engine
+
+# summary column of each application status
+STAGES = {s: s.replace('-', '_') for s in engine.STATUSES.tolist()}
+
+# stage-to-stage conversion rates of the funnel_conversion view
+RATES = {
+	'approval_rate': ('approved', 'applied'),
+	'offer_rate': ('offered', 'approved'),
+	'acceptance_rate': ('accepted', 'offered'),
+	'hard_pull_rate': ('hard_pull', 'accepted'),
+	'conversion_rate': ('converted', 'hard_pull'),
+	'overall_rate': ('converted', 'applied'),
+}
+
+# an application belongs to the week of its first status, kept in funnel_cohorts
+WEEK = "date({}, '-6 days', 'weekday 1')"
+COLUMNS = ', '.join(STAGES.values())
+INCREMENTS = ', '.join(f'{c} = {c} + excluded.{c}' for c in STAGES.values())
+
+def install(db):
+	'''
+	backfill funnel_summary from the applications already loaded and install the trigger
+	that keeps it up to date for every application row inserted afterwards.
+	meant to run after bulk loads, so rows loaded before are aggregated in one pass.
+	rows may arrive in any order: a row earlier than the first status of its application
+	moves the counts of the application to the week of the new first status.
+	'''
+	start_time = time.time()
+	counts = ', '.join(f"sum(a.status = '{s}')" for s in STAGES.keys())
+	with db.engine.begin() as cn:
+		cn.execute(text('DROP TRIGGER IF EXISTS funnel_summary_insert'))
+		cn.execute(text('DELETE FROM funnel_summary'))
+		cn.execute(text('DELETE FROM funnel_cohorts'))
+		cn.execute(text(f'''
+			INSERT INTO funnel_cohorts (application_id, first_dt, week)
+			SELECT application_id, min(status_dt), {WEEK.format('min(status_dt)')}
+			FROM applications
+			GROUP BY application_id
+		'''))
+		cn.execute(text(f'''
+			INSERT INTO funnel_summary (campaign_id, channel_id, week, {COLUMNS})
+			SELECT a.campaign_id, coalesce(c.channel_id, ''), w.week, {counts}
+			FROM applications a
+			JOIN funnel_cohorts w ON w.application_id = a.application_id
+			LEFT JOIN campaigns c ON c.campaign_id = a.campaign_id
+			GROUP BY a.campaign_id, c.channel_id, w.week
+		'''))
+		increments = ', '.join(f"NEW.status = '{s}'" for s in STAGES.keys())
+		cohort = 'SELECT {} FROM funnel_cohorts WHERE application_id = NEW.application_id'
+		# the earlier rows of the application change week when NEW comes before its first status
+		moved = f"NEW.status_dt < ({cohort.format('first_dt')}) AND {WEEK.format('NEW.status_dt')} <> ({cohort.format('week')})"
+		earlier = 'a.application_id = NEW.application_id AND a.status_dt <> NEW.status_dt'
+		channel = "coalesce((SELECT channel_id FROM campaigns WHERE campaign_id = {}), '')"
+		zero = ' AND '.join(f'{c} = 0' for c in STAGES.values())
+		# every lookup is a primary key search
+		cn.execute(text(f'''
+			CREATE TRIGGER funnel_summary_insert AFTER INSERT ON applications
+			BEGIN
+				INSERT INTO funnel_summary (campaign_id, channel_id, week, {COLUMNS})
+				SELECT a.campaign_id, {channel.format('a.campaign_id')}, ({cohort.format('week')}), {counts.replace('sum(', '-sum(')}
+				FROM applications a
+				WHERE {earlier} AND {moved}
+				GROUP BY a.campaign_id
+				ON CONFLICT (campaign_id, channel_id, week) DO UPDATE SET {INCREMENTS};
+				DELETE FROM funnel_summary
+				WHERE {moved} AND week = ({cohort.format('week')}) AND {zero}
+					AND campaign_id IN (SELECT campaign_id FROM applications WHERE application_id = NEW.application_id);
+				INSERT INTO funnel_summary (campaign_id, channel_id, week, {COLUMNS})
+				SELECT a.campaign_id, {channel.format('a.campaign_id')}, {WEEK.format('NEW.status_dt')}, {counts}
+				FROM applications a
+				WHERE {earlier} AND {moved}
+				GROUP BY a.campaign_id
+				ON CONFLICT (campaign_id, channel_id, week) DO UPDATE SET {INCREMENTS};
+				INSERT INTO funnel_cohorts (application_id, first_dt, week)
+				VALUES (NEW.application_id, NEW.status_dt, {WEEK.format('NEW.status_dt')})
+				ON CONFLICT (application_id) DO UPDATE SET first_dt = excluded.first_dt, week = excluded.week
+				WHERE excluded.first_dt < funnel_cohorts.first_dt;
+				INSERT INTO funnel_summary (campaign_id, channel_id, week, {COLUMNS})
+				SELECT NEW.campaign_id, {channel.format('NEW.campaign_id')}, ({cohort.format('week')}), {increments}
+				WHERE true
+				ON CONFLICT (campaign_id, channel_id, week) DO UPDATE SET {INCREMENTS};
+			END
+		'''))
+		rates = ', '.join(f'1.0 * {n} / nullif({d}, 0) AS {r}' for r, (n, d) in RATES.items())
+		cn.execute(text('DROP VIEW IF EXISTS funnel_conversion'))
+		cn.execute(text(f'''
+			CREATE VIEW funnel_conversion AS
+			SELECT campaign_id, channel_id, week, {COLUMNS}, {rates}
+			FROM funnel_summary
+		'''))
+	print(f'finished installing the funnel summary, took {int(time.time() - start_time)}s.')
+
+def conversion(db, campaign_id=None, channel_id=None, start=None, end=None):
+	# stage counts and conversion rates, start and end are inclusive week bounds
+	conditions = []
+	params = dict()
+	for column, value in [('campaign_id', campaign_id), ('channel_id', channel_id)]:
+		if value is not None:
+			conditions.append(f'{column} = :{column}')
+			params[column] = value
+	if start is not None:
+		conditions.append('week >= :start')
+		params['start'] = str(start)
+	if end is not None:
+		conditions.append('week <= :end')
+		params['end'] = str(end)
+	where = f"WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ''
+	with db.engine.connect() as cn:
+		return cn.execute(text(f'SELECT * FROM funnel_conversion {where} ORDER BY week, campaign_id, channel_id'), params).mappings().all()
+
+def summary(db, week):
+	# summary rows of a week as mapped objects
+	return db.session.scalars(select(FunnelSummary).where(FunnelSummary.week == week)).all()
@@ -0,0 +1,150 @@
+import os
+import time
+from sqlalchemy import func, select, text
+
+from database import SQLite
+from entities_compact import Base, Activity, ApplicationKey, Campaign, Channel, Customer, Product, Visitor
+
+# ids per lookup, below the sqlite limit of bound parameters
+CHUNK_SIZE = 500
+
+# dictionary of each kind of external id: (entity, id column, key column)
+DICTIONARIES = {
+	'activity': (Activity, 'activity_id', 'activity_key'),
+	'application': (ApplicationKey, 'application_id', 'application_key'),
+	'campaign': (Campaign, 'campaign_id', 'campaign_key'),
+	'channel': (Channel, 'channel_id', 'channel_key'),
+	'customer': (Customer, 'customer_id', 'customer_key'),
+	'product': (Product, 'product_id', 'product_key'),
+	'visitor': (Visitor, 'visitor_id', 'visitor_key'),
+}
+
+class KeyMap:
+	'''
+	maps the external string ids of one kind to the integer keys of a compact database and back.
+	lookups are cached and misses are fetched in batches through the unique index on the id.
+	'''
+
+	def __init__(self, db, kind):
+		entity, id_column, key_column = DICTIONARIES[kind]
+		self.db = db
+		self.table = entity.__table__
+		self.id_column = self.table.c[id_column]
+		self.key_column = self.table.c[key_column]
+		self.keys = dict()
+		self.ids = dict()
+		self.next_key = None
+
+	def encode(self, ids):
+		# keys of ids, None for unknown ids
+		ids = list(ids)
+		self._fetch(self.id_column, [i for i in set(ids) if i not in self.keys])
+		return [self.keys.get(i) for i in ids]
+
+	def decode(self, keys):
+		# ids of keys, None for unknown keys
+		keys = list(keys)
+		self._fetch(self.key_column, [k for k in set(keys) if k not in self.ids])
+		return [self.ids.get(k) for k in keys]
+
+	def assign(self, ids):
+		'''
+		keys of ids, new ids get the next free keys. the new rows are not written,
+		the caller inserts them with both the key and the id (e.g. in bulk_insert).
+		'''
+		ids = list(ids)
+		keys = self.encode(ids)
+		if self.next_key is None:
+			with self.db.engine.connect() as cn:
+				self.next_key = (cn.execute(select(func.max(self.key_column))).scalar() or 0) + 1
+		for n, (i, k) in enumerate(zip(ids, keys)):
+			if k is None:
+				k = self.keys.get(i)
+			if k is None:
+				k = self.next_key
+				self.next_key += 1
+				self._remember(k, i)
+			keys[n] = k
+		return keys
+
+	def _fetch(self, column, values):
+		with self.db.engine.connect() as cn:
+			for i in range(0, len(values), CHUNK_SIZE):
+				query = select(self.key_column, self.id_column).where(column.in_(values[i:i + CHUNK_SIZE]))
+				for k, i in cn.execute(query):
+					self._remember(k, i)
+
+	def _remember(self, key, id):
+		self.keys[id] = key
+		self.ids[key] = id
+
+def compact(src_path, dst_path):
+	'''
+	copy a database of entities.py into the compact-key schema of entities_compact.py.
+	keys are assigned in id order, string ids are replaced with keys through joins on the
+	dimension tables, and secondary indexes are built after the copy.
+	'''
+	start_time = time.time()
+	db = SQLite(dst_path, create=True, renew=True, read_only=False, defer_indexes=True)
+	db.connect(Base)
+	with db.bulk_load():
+		with db.engine.connect() as cn:
+			cn = cn.execution_options(isolation_level='AUTOCOMMIT')
+			cn.execute(text('ATTACH DATABASE :path AS src'), {'path': src_path})
+			cn.execute(text('BEGIN'))
+			for statement in COPY_STATEMENTS:
+				cn.execute(text(statement))
+			cn.execute(text('COMMIT'))
+			cn.execute(text('DETACH DATABASE src'))
+		db.create_indexes()
+	db.optimize()
+	print(f'finished compacting {src_path} ({os.path.getsize(src_path)} bytes) into {dst_path} ' + \
+		f'({os.path.getsize(dst_path)} bytes), took {int(time.time() - start_time)}s.')
+	return db
+
+COPY_STATEMENTS = [
+	'''INSERT INTO products (product_id, product_name, headline_rate_lb, headline_rate_ub)
+		SELECT product_id, product_name, headline_rate_lb, headline_rate_ub FROM src.products ORDER BY product_id''',
+	'''INSERT INTO channels (channel_id, channel_name)
+		SELECT channel_id, channel_name FROM src.channels ORDER BY channel_id''',
+	'''INSERT INTO customers (customer_id, card_member_ind, dpl_ind)
+		SELECT customer_id, card_member_ind, dpl_ind FROM src.customers ORDER BY customer_id''',
+	'''INSERT INTO campaigns (campaign_id, campaign_name, channel_key, product_key)
+		SELECT c.campaign_id, c.campaign_name, h.channel_key, p.product_key FROM src.campaigns c
+		LEFT JOIN channels h ON h.channel_id = c.channel_id
+		LEFT JOIN products p ON p.product_id = c.product_id
+		ORDER BY c.campaign_id''',
+	'''INSERT INTO visitors (visitor_id, customer_key)
+		SELECT v.visitor_id, u.customer_key FROM src.visitors v
+		LEFT JOIN customers u ON u.customer_id = v.customer_id
+		ORDER BY v.visitor_id''',
+	'''INSERT INTO application_keys (application_id)
+		SELECT DISTINCT application_id FROM src.applications ORDER BY application_id''',
+	'''INSERT INTO activities (activity_id, visitor_key, clicked_dt, clicked_campaign_key, clicked_channel_key)
+		SELECT a.activity_id, v.visitor_key, a.clicked_dt, c.campaign_key, h.channel_key FROM src.activities a
+		JOIN visitors v ON v.visitor_id = a.visitor_id
+		JOIN campaigns c ON c.campaign_id = a.clicked_campaign
+		JOIN channels h ON h.channel_id = a.clicked_channel
+		ORDER BY a.activity_id''',
+	'''INSERT INTO applications (application_key, status_dt, status, visitor_key, conversion_flag, campaign_key)
+		SELECT k.application_key, a.status_dt, a.status, v.visitor_key, a.conversion_flag, c.campaign_key
+		FROM src.applications a
+		JOIN application_keys k ON k.application_id = a.application_id
+		JOIN visitors v ON v.visitor_id = a.visitor_id
+		JOIN campaigns c ON c.campaign_id = a.campaign_id''',
+	'''INSERT INTO target_population (campaign_key, visitor_key, offer_id, resp_prob, conv_prob, cus_value,
+			eligibility_flag, expected_approval_rate, valid_from, valid_to)
+		SELECT c.campaign_key, v.visitor_key, t.offer_id, t.resp_prob, t.conv_prob, t.cus_value,
+			t.eligibility_flag, t.expected_approval_rate, t.valid_from, t.valid_to
+		FROM src.target_population t
+		JOIN campaigns c ON c.campaign_id = t.campaign_id
+		JOIN visitors v ON v.visitor_id = t.visitor_id''',
+	'''INSERT INTO marketing_spend (campaign_key, start_dt, end_dt, channel_spend, campaign_spend)
+		SELECT c.campaign_key, s.start_dt, s.end_dt, s.channel_spend, s.campaign_spend
+		FROM src.marketing_spend s JOIN campaigns c ON c.campaign_id = s.campaign_id''',
+	'''INSERT INTO customer_products (customer_key, product_key, status, start_dt, end_dt)
+		SELECT u.customer_key, p.product_key, x.status, x.start_dt, x.end_dt
+		FROM src.customer_products x
+		JOIN customers u ON u.customer_id = x.customer_id
+		JOIN products p ON p.product_id = x.product_id''',
+]
@@ -0,0 +1,223 @@
+import csv
+from datetime import date, datetime
+import os
+import time
+import zlib
+from sqlalchemy import Table, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from entities_ana import LoadWatermark
+import dictionary
+
+# rows per chunk read from a file, memory is bounded by one chunk
+CHUNK_SIZE = 100000
+# rows between progress reports
+REPORT_EVERY = 1000000
+# checksums are sums of crc32 kept within a signed 64 bit integer
+CHECKSUM_MODULUS = 2 ** 63
+
+def coercers(table, date_format=None, datetime_format=None):
+	'''
+	one function per column converting a text value to the mapped python type.
+	'''
+	def to_date(value):
+		return date.fromisoformat(value) if date_format is None else datetime.strptime(value, date_format).date()
+	def to_datetime(value):
+		return datetime.fromisoformat(value) if datetime_format is None else datetime.strptime(value, datetime_format)
+	def to_bool(value):
+		return value.strip().lower() in {'1', 'true', 't', 'y', 'yes'}
+	def to_int(value):
+		# integers are sometimes exported as 123.0
+		return int(float(value)) if '.' in value else int(value)
+	functions = dict()
+	for c in table.columns:
+		python_type = c.type.python_type
+		if c.info.get('dictionary'):
+			# text in the extract, encoded to an integer code before inserting
+			f = str
+		elif python_type is datetime:
+			f = to_datetime
+		elif python_type is date:
+			f = to_date
+		elif python_type is bool:
+			f = to_bool
+		elif python_type is int:
+			f = to_int
+		elif python_type is float:
+			f = float
+		else:
+			f = str
+		functions[c.key] = f
+	return functions
+
+def read_delimited(path, table, delimiter=',', date_format=None, datetime_format=None, encoding='utf-8'):
+	# stream rows of a delimited file as dicts of column key to coerced value, headers match column names case-insensitively.
+	# empty values are left out so that the column default applies
+	functions = coercers(table, date_format, datetime_format)
+	with open(path, newline='', encoding=encoding) as f:
+		reader = csv.reader(f, delimiter=delimiter)
+		header = next(reader)
+		columns = _match_columns(header, functions, path)
+		for values in reader:
+			row = dict()
+			for i, key in columns:
+				value = values[i]
+				if value != '':
+					row[key] = functions[key](value)
+			yield row
+
+def read_parquet(path, table, batch_size=CHUNK_SIZE):
+	# stream rows of a parquet file one record batch at a time, requires pyarrow
+	try:
+		import pyarrow.parquet as pq
+	except ImportError:
+		raise ImportError('loading parquet files requires pyarrow, please pip install pyarrow.')
+	functions = coercers(table)
+	parquet = pq.ParquetFile(path)
+	columns = _match_columns(parquet.schema_arrow.names, functions, path)
+	for batch in parquet.iter_batches(batch_size=batch_size, columns=[parquet.schema_arrow.names[i] for i, _ in columns]):
+		for values in zip(*batch.to_pydict().values()):
+			row = dict()
+			for (_, key), value in zip(columns, values):
+				# parquet values are typed already, only text needs coercing
+				if value is None or value == '':
+					continue
+				row[key] = functions[key](value) if isinstance(value, str) else value
+			yield row
+
+def read(path, table, **kwargs):
+	if os.path.splitext(path)[1].lower() in {'.parquet', '.pq'}:
+		return read_parquet(path, table, **kwargs)
+	if os.path.splitext(path)[1].lower() in {'.tsv', '.tab'}:
+		kwargs.setdefault('delimiter', '\t')
+	return read_delimited(path, table, **kwargs)
+
+def load(db, entity, path, chunk_size=CHUNK_SIZE, report_every=REPORT_EVERY, **kwargs):
+	'''
+	stream a csv, tsv or parquet file into the table of entity in chunks,
+	kwargs are passed to the reader (delimiter, date_format, encoding...).
+	the periods loaded are recorded in load_watermarks for later refreshes.
+	'''
+	table = entity if isinstance(entity, Table) else entity.__table__
+	period = period_column(table)
+	stats = dict()
+	print(f'loading {path} into {table.name}.')
+	rows = _progress(read(path, table, **kwargs), table.name, report_every)
+	if period is not None:
+		rows = _collect(rows, table, period, stats)
+	total = db.bulk_insert(table, _encode(_encoder(db, table), table, rows), chunk_size=chunk_size)
+	_save_watermarks(db, table, stats)
+	return total
+
+def refresh(db, entity, path, chunk_size=CHUNK_SIZE, report_every=REPORT_EVERY, **kwargs):
+	'''
+	idempotent incremental load of a snapshot that may restate old periods.
+	a first pass computes row counts and checksums per period, a second pass replaces
+	only the periods that differ from load_watermarks. tables without a period are upserted whole.
+	'''
+	table = entity if isinstance(entity, Table) else entity.__table__
+	period = period_column(table)
+	if period is None:
+		print(f'refreshing {path} into {table.name}, no period column.')
+		return db.bulk_insert(table, _encode(_encoder(db, table), table, _progress(read(path, table, **kwargs), table.name, report_every)),
+			chunk_size=chunk_size, upsert=True)
+	stats = dict()
+	# the first pass also assigns the dictionary codes of new values, the second one runs in a
+	# single transaction and must not write them
+	encoder = _encoder(db, table)
+	for _ in _encode(encoder, table, _collect(read(path, table, **kwargs), table, period, stats)):
+		pass
+	stored = watermarks(db, table.name)
+	changed = {p: s for p, s in stats.items() if stored.get(p) != s}
+	print(f'refreshing {path} into {table.name}, {len(changed)} of {len(stats)} periods changed.')
+	if len(changed) == 0:
+		return 0
+	# the changed periods are replaced, so rows dropped by a restatement are removed as well
+	rows = (r for r in read(path, table, **kwargs) if r.get(period) in changed)
+	total = db.replace(table, period, changed.keys(), _encode(encoder, table, _progress(rows, table.name, report_every)),
+		chunk_size=chunk_size)
+	_save_watermarks(db, table, changed)
+	return total
+
+def watermarks(db, table_name):
+	# period to (row count, checksum) loaded for a table
+	query = select(LoadWatermark.period, LoadWatermark.row_count, LoadWatermark.checksum) \
+		.where(LoadWatermark.table_name == table_name)
+	with db.engine.connect() as cn:
+		return {p: (count, checksum) for p, count, checksum in cn.execute(query)}
+
+def period_column(table):
+	# the first date column of the primary key, e.g. perf_week
+	for c in table.primary_key.columns:
+		if c.type.python_type is date:
+			return c.key
+	return None
+
+def load_directory(db, base, directory, incremental=False, exclude=(), **kwargs):
+	# load every file named after a table of base, e.g. responder_history.csv, except the excluded tables
+	totals = dict()
+	if not os.path.isdir(directory):
+		return totals
+	tables = base.metadata.tables
+	f = refresh if incremental else load
+	for name in sorted(os.listdir(directory)):
+		table_name = os.path.splitext(name)[0].lower()
+		if table_name in tables and table_name not in exclude:
+			totals[table_name] = totals.get(table_name, 0) + \
+				f(db, tables[table_name], os.path.join(directory, name), **kwargs)
+	return totals
+
+def _collect(rows, table, period, stats):
+	# per-period row count and an order independent checksum of the rows passing through
+	keys = [c.key for c in table.columns]
+	for row in rows:
+		p = row.get(period)
+		count, checksum = stats.get(p, (0, 0))
+		crc = zlib.crc32(repr(tuple(row.get(k) for k in keys)).encode())
+		stats[p] = (count + 1, (checksum + crc) % CHECKSUM_MODULUS)
+		yield row
+
+def _save_watermarks(db, table, stats):
+	if len(stats) == 0:
+		return
+	statement = sqlite_insert(LoadWatermark.__table__)
+	statement = statement.on_conflict_do_update(
+		index_elements=['table_name', 'period'],
+		set_={c: statement.excluded[c] for c in ['row_count', 'checksum', 'loaded_at']}
+	)
+	loaded_at = datetime.now()
+	with db.engine.begin() as cn:
+		cn.execute(statement, [
+			{'table_name': table.name, 'period': p, 'row_count': count, 'checksum': checksum, 'loaded_at': loaded_at}
+			for p, (count, checksum) in stats.items()
+		])
+
+def _encoder(db, table):
+	if len(dictionary.coded_columns(table)) == 0:
+		return None
+	return dictionary.Encoder(db)
+
+def _encode(encoder, table, rows):
+	# checksums are computed on the text values, codes are only assigned on the way into the table
+	if encoder is None:
+		return rows
+	return encoder.encode(table, rows)
+
+def _match_columns(header, functions, path):
+	keys = {k.lower(): k for k in functions.keys()}
+	columns = []
+	for i, name in enumerate(header):
+		key = keys.get(name.strip().lower())
+		if key is None:
+			print(f'ignoring column {name} of {path}.')
+		else:
+			columns.append((i, key))
+	return columns
+
+def _progress(rows, name, report_every):
+	start_time = time.time()
+	for i, row in enumerate(rows, 1):
+		yield row
+		if i % report_every == 0:
+			elapsed = time.time() - start_time
+			print(f'read {i} rows for {name}, took {int(elapsed)}s ({int(i / max(elapsed, 1e-6))} rows/s).')
@@ -1,8 +1,38 @@
 from database import SQLite
 from entities_ana import *
 from utils import *
+import dictionary
+import loader
+import partitions
+import solicited
 
-db = SQLite('demo_ana.db', create=True, renew=True, read_only=False)
+# extracts named after their table, e.g. responder_history.csv or model_score_history.parquet
+EXTRACT_DIR = 'extracts'
+
+# refresh the existing database with the changed periods of the extracts instead of rebuilding it
+REFRESH = False
+
+# store solicited_history extracts in long format (solicited_weeks and solicited_offers)
+SOLICITED_LONG = False
+
+# store the communication and eligibility histories in one file per month (see partitions.py)
+PARTITION_DIR = None
+
+db = SQLite('demo_ana.db', create=True, renew=not REFRESH, read_only=False)
 db.connect(Base)
+store = db if PARTITION_DIR is None else partitions.PartitionedStore(db, PARTITION_DIR, renew=not REFRESH)
+
+with store.bulk_load():
+	if SOLICITED_LONG:
+		loader.load_directory(store, Base, EXTRACT_DIR, incremental=REFRESH, exclude={SolicitedHistory.__tablename__})
+		solicited.load_directory(db, EXTRACT_DIR, incremental=REFRESH)
+	else:
+		loader.load_directory(store, Base, EXTRACT_DIR, incremental=REFRESH)
+if PARTITION_DIR is not None:
+	store.close()
+if SOLICITED_LONG:
+	solicited.install_view(db)
+# communication histories with their dictionary codes decoded
+dictionary.install_views(db, Base)
 
 db.close()
\ No newline at end of file
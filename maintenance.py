@@ -0,0 +1,60 @@
+import threading
+
+# seconds between WAL size checks
+INTERVAL = 60
+# checks between incremental vacuum steps and between ANALYZE runs
+VACUUM_EVERY = 10
+ANALYZE_EVERY = 60
+
+class Maintenance:
+	'''
+	background maintenance of a long-running process: checkpoints driven by the size of the WAL
+	every interval seconds, one bounded incremental vacuum step and a bounded ANALYZE now and then.
+	every operation is short and leaves readers online, e.g.
+
+		with Maintenance(db):
+			serve()
+	'''
+
+	def __init__(self, db, interval=INTERVAL, vacuum_every=VACUUM_EVERY, analyze_every=ANALYZE_EVERY):
+		self.db = db
+		self.interval = interval
+		self.vacuum_every = vacuum_every
+		self.analyze_every = analyze_every
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.stopped.clear()
+		self.thread = threading.Thread(target=self._run, name='sqlite-maintenance', daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def run_once(self, tick=0):
+		self.db.checkpoint()
+		if self.vacuum_every > 0 and tick % self.vacuum_every == 0:
+			self.db.incremental_vacuum(max_steps=1)
+		if self.analyze_every > 0 and tick % self.analyze_every == 0:
+			self.db.analyze()
+
+	def _run(self):
+		tick = 0
+		while not self.stopped.wait(self.interval):
+			tick += 1
+			try:
+				self.run_once(tick)
+			except Exception as e:
+				# a busy database is retried at the next tick
+				print(f'maintenance of {self.db.db_path} failed, {e}.')
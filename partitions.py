@@ -0,0 +1,285 @@
+from contextlib import ExitStack, contextmanager
+from datetime import date
+import os
+import shutil
+import time
+from sqlalchemy import insert, text
+
+from database import SQLite, _defaults, _replace_rows, _stream_rows, _to_params, _to_table, _upsert, remove
+from entities_ana import DMCommunicationHistory, EmailCommunicationHistory, LoadWatermark, \
+	MarketingEligibilityHistory, RiskEligibilityHistory, WTCommunicationHistory
+import dictionary
+import loader
+
+# history tables stored in one file per period of their date column
+TABLES = [DMCommunicationHistory, EmailCommunicationHistory, WTCommunicationHistory,
+	RiskEligibilityHistory, MarketingEligibilityHistory]
+GRANULARITIES = ['month', 'quarter']
+# sqlite attaches at most 10 databases to a connection, the main database counts as one more
+MAX_ATTACHED = 9
+
+def partition_key(value, granularity='month'):
+	# e.g. 2024-03 for a month or 2024-Q1 for a quarter, keys sort in time order
+	d = value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+	if granularity == 'quarter':
+		return f'{d.year}-Q{(d.month - 1) // 3 + 1}'
+	return f'{d.year}-{d.month:02d}'
+
+class PartitionedStore:
+	'''
+	routes the rows of the partitioned history tables to one sqlite file per month or quarter,
+	e.g. partitions/demo_ana_2024-03.db, other tables go to the main database. bulk_insert, replace,
+	bulk_load, read and engine match SQLite, so the store can be given to loader.load, loader.refresh
+	or any reader of the histories (asof.py, feature_store.py, response_attribution.py, advisor.py).
+	query() attaches the partitions of a date range and shadows the tables with UNION ALL views,
+	stream_rows() reads any number of partitions one after the other (or merged on a sort key).
+	'''
+
+	def __init__(self, db, directory, granularity='month', tables=TABLES, renew=False):
+		if granularity not in GRANULARITIES:
+			raise ValueError(f'granularity should be one of {GRANULARITIES}, got {granularity}.')
+		self.db = db
+		self.engine = db.engine
+		self.db_path = db.db_path
+		# profile of the partitions, switched by bulk_load
+		self.profile = 'default'
+		self.directory = directory
+		self.granularity = granularity
+		self.tables = {_to_table(t).name: _to_table(t) for t in tables}
+		self.prefix = os.path.splitext(os.path.basename(db.db_path))[0]
+		self.partitions = dict()
+		os.makedirs(directory, exist_ok=True)
+		if renew:
+			for key in self.keys():
+				remove(self.path(key))
+
+	def path(self, key, directory=None):
+		return os.path.join(directory or self.directory, f'{self.prefix}_{key}.db')
+
+	def keys(self, directory=None):
+		# partitions in a directory, in time order
+		directory = directory or self.directory
+		keys = []
+		for name in os.listdir(directory):
+			if name.startswith(self.prefix + '_') and name.endswith('.db'):
+				keys.append(name[len(self.prefix) + 1:-3])
+		return sorted(keys)
+
+	def partition(self, key):
+		# the SQLite instance of a partition, created with the tables on first use
+		if key not in self.partitions:
+			p = SQLite(self.path(key), read_only=False, profile=self.profile)
+			p.connect(None)
+			for table in self.tables.values():
+				table.create(p.engine, checkfirst=True)
+			self.partitions[key] = p
+		return self.partitions[key]
+
+	@contextmanager
+	def bulk_load(self, profile='bulk_load'):
+		# the main database and every partition, opened before or during the load, use profile
+		previous = self.profile
+		self.profile = profile
+		for p in self.partitions.values():
+			p.set_profile(profile)
+		try:
+			with self.db.bulk_load(profile):
+				yield self
+		finally:
+			self.profile = previous
+			for p in self.partitions.values():
+				p.set_profile(previous)
+				p.checkpoint('TRUNCATE')
+
+	def bulk_insert(self, entity, rows, chunk_size=100000, upsert=False):
+		table = _to_table(entity)
+		if table.name not in self.tables:
+			return self.db.bulk_insert(table, rows, chunk_size=chunk_size, upsert=upsert)
+		period = loader.period_column(table)
+		start_time = time.time()
+		total = 0
+		buffers = dict()
+		buffered = 0
+		for row in rows:
+			buffers.setdefault(partition_key(row[period], self.granularity), []).append(row)
+			buffered += 1
+			# the buffers of all partitions together hold at most chunk_size rows
+			if buffered >= chunk_size:
+				total += sum(self._insert(key, table, buffer, upsert) for key, buffer in buffers.items())
+				buffers = dict()
+				buffered = 0
+		total += sum(self._insert(key, table, buffer, upsert) for key, buffer in buffers.items())
+		elapsed = time.time() - start_time
+		print(f'finished partitioning {total} rows of {table.name}, took {int(elapsed)}s ' + \
+			f'({int(total / max(elapsed, 1e-6))} rows/s).')
+		return total
+
+	def _insert(self, key, table, rows, upsert):
+		p = self.partition(key)
+		return p._insert_rows(table, rows, len(rows), _upsert(table) if upsert else insert(table))
+
+	def replace(self, entity, column, values, rows, chunk_size=100000):
+		'''
+		SQLite.replace routed by period, the rows of every partition are deleted and inserted
+		in one transaction of its file. all transactions are committed after the last row.
+		'''
+		table = _to_table(entity)
+		if table.name not in self.tables:
+			return self.db.replace(table, column, values, rows, chunk_size=chunk_size)
+		period = loader.period_column(table)
+		start_time = time.time()
+		groups = dict()
+		for value in values:
+			if column == period:
+				groups.setdefault(partition_key(value, self.granularity), []).append(value)
+			else:
+				# values of another column can be in any partition
+				for key in self.keys():
+					groups.setdefault(key, []).append(value)
+		statement = insert(table)
+		defaults = _defaults(table)
+		total = 0
+		with ExitStack() as stack:
+			connections = dict()
+			def connection(key):
+				if key not in connections:
+					connections[key] = stack.enter_context(self.partition(key).engine.begin())
+					_replace_rows(connections[key], table, column, groups.get(key, []), [], chunk_size)
+				return connections[key]
+			for key in groups:
+				connection(key)
+			def flush(buffers):
+				for key, buffer in buffers.items():
+					connection(key).execute(statement, buffer)
+				return sum(len(buffer) for buffer in buffers.values())
+			buffers = dict()
+			buffered = 0
+			for row in rows:
+				buffers.setdefault(partition_key(row[period], self.granularity), []).append(_to_params(row, defaults))
+				buffered += 1
+				if buffered >= chunk_size:
+					total += flush(buffers)
+					buffers = dict()
+					buffered = 0
+			total += flush(buffers)
+		print(f'finished replacing {total} rows of {len(values)} {column} in {len(groups)} partitions of {table.name}, ' + \
+			f'took {int(time.time() - start_time)}s.')
+		return total
+
+	def _keys(self, start=None, end=None):
+		# the partitions overlapping [start, end]
+		lo = None if start is None else partition_key(start, self.granularity)
+		hi = None if end is None else partition_key(end, self.granularity)
+		return [k for k in self.keys() if (lo is None or k >= lo) and (hi is None or k <= hi)]
+
+	def _names(self, tables):
+		# the partitioned tables among tables (entities, tables or names), all of them if None
+		if tables is None:
+			return list(self.tables)
+		names = {t if isinstance(t, str) else _to_table(t).name for t in tables}
+		return [name for name in self.tables if name in names or name + dictionary.VIEW_POSTFIX in names]
+
+	@contextmanager
+	def query(self, start=None, end=None, tables=None):
+		'''
+		a connection of the main database where the partitioned tables that are read (tables, all
+		if None) are UNION ALL views of the partitions overlapping [start, end], the others are not
+		attached (pruned). the decoded <table>_view of dictionary.py are shadowed the same way.
+		sqlite attaches at most MAX_ATTACHED partitions, wider ranges are read with stream_rows.
+		'''
+		names = self._names(tables)
+		keys = self._keys(start, end) if len(names) > 0 else []
+		if len(keys) > MAX_ATTACHED:
+			raise ValueError(f'{len(keys)} partitions overlap [{start}, {end}], at most {MAX_ATTACHED} ' + \
+				'can be attached, use stream_rows.')
+		attached = []
+		with self.db.engine.connect() as cn:
+			cn = cn.execution_options(isolation_level='AUTOCOMMIT')
+			try:
+				aliases = [self._attach(cn, key, attached) for key in keys]
+				for name in names:
+					if len(aliases) == 0:
+						continue
+					# temp views are resolved before the (empty) tables of the main database
+					union = ' UNION ALL '.join(f'SELECT * FROM {alias}.{name}' for alias in aliases)
+					cn.execute(text(f'CREATE TEMP VIEW {name} AS {union}'))
+					select = dictionary.decoded_select(self.tables[name])
+					if select is not None:
+						cn.execute(text(f'CREATE TEMP VIEW {name}{dictionary.VIEW_POSTFIX} AS {select}'))
+				yield cn
+			finally:
+				for name in names:
+					cn.execute(text(f'DROP VIEW IF EXISTS temp.{name}{dictionary.VIEW_POSTFIX}'))
+					cn.execute(text(f'DROP VIEW IF EXISTS temp.{name}'))
+				for alias in attached:
+					cn.execute(text(f'DETACH DATABASE {alias}'))
+
+	def read(self, start=None, end=None, tables=None):
+		# SQLite.read, the histories of [start, end] are visible
+		return self.query(start, end, tables)
+
+	def stream_rows(self, entity, query, params=None, start=None, end=None, key=None):
+		'''
+		SQLite.stream_rows run on every partition overlapping [start, end] on its own connection,
+		one partition after the other or merged on key. nothing is attached or copied, so any
+		number of partitions can be read. other tables are read from the main database.
+		'''
+		name = entity if isinstance(entity, str) else _to_table(entity).name
+		if name not in self.tables:
+			return self.db.stream_rows(entity, query, params=params, key=key)
+		engines = [self.partition(k)._readers() for k in self._keys(start, end)]
+		return _stream_rows(engines, query, params, key)
+
+	def connections(self, entity, start=None, end=None):
+		# SQLite.connections, one connection of every partition overlapping [start, end] at a time
+		name = entity if isinstance(entity, str) else _to_table(entity).name
+		if name not in self.tables:
+			yield from self.db.connections(entity)
+			return
+		for k in self._keys(start, end):
+			with self.partition(k).engine.connect() as cn:
+				yield cn.execution_options(isolation_level='AUTOCOMMIT')
+
+	def _attach(self, cn, key, attached):
+		alias = 'p_' + key.replace('-', '_').lower()
+		cn.execute(text(f'ATTACH DATABASE :path AS {alias}'), {'path': self.path(key)})
+		attached.append(alias)
+		return alias
+
+	def close(self, key=None):
+		for k in [key] if key is not None else list(self.partitions.keys()):
+			if k in self.partitions:
+				self.partitions.pop(k).close()
+
+	def archive(self, key, directory):
+		# move a partition out of the store, it is no longer part of any query
+		self.close(key)
+		os.makedirs(directory, exist_ok=True)
+		for postfix in ['', '-wal', '-shm']:
+			if os.path.exists(self.path(key) + postfix):
+				shutil.move(self.path(key) + postfix, self.path(key, directory) + postfix)
+		print(f'finished archiving partition {key} to {directory}.')
+
+	def restore(self, key, directory):
+		for postfix in ['', '-wal', '-shm']:
+			if os.path.exists(self.path(key, directory) + postfix):
+				shutil.move(self.path(key, directory) + postfix, self.path(key) + postfix)
+		print(f'finished restoring partition {key} from {directory}.')
+
+	def truncate(self, key, entity):
+		# empty one table of one partition before reloading it, with the watermarks of its periods
+		table = _to_table(entity)
+		with self.partition(key).engine.begin() as cn:
+			cn.execute(table.delete())
+		periods = [p for p in loader.watermarks(self.db, table.name) if partition_key(p, self.granularity) == key]
+		w = LoadWatermark.__table__
+		with self.db.engine.begin() as cn:
+			cn.execute(w.delete().where(w.c.table_name == table.name, w.c.period.in_(periods)))
+
+	def vacuum(self, key):
+		# rebuild the file of one partition, the others are not touched
+		start_time = time.time()
+		p = self.partition(key)
+		with p.engine.connect() as cn:
+			cn.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+		print(f'finished vacuuming partition {key}, took {int(time.time() - start_time)}s.')
@@ -0,0 +1,167 @@
+from bisect import bisect_left
+import functools
+import json
+import re
+import threading
+import time
+from sqlalchemy import event
+
+# calls at least this slow are counted as slow, the first slow call of a select gets its query plan captured
+SLOW_SECONDS = 0.1
+# upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+BUCKETS = [0.001, 0.01, 0.1, 1, 10, 100]
+
+def normalize(statement):
+	# statements that differ only by literals or the length of IN lists share their statistics
+	statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+	statement = re.sub(r'\b\d+(?:\.\d+)?\b', '?', statement)
+	statement = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', statement)
+	return ' '.join(statement.split())
+
+def full_scans(plan):
+	# tables read without an index in an EXPLAIN QUERY PLAN
+	scans = []
+	for detail in plan:
+		if detail.startswith('SCAN ') and 'INDEX' not in detail and 'CONSTANT ROW' not in detail:
+			scans.append(detail.split()[1])
+	return scans
+
+class _Cursor:
+	'''
+	DBAPI cursor of a statement returning rows, counts the rows fetched and the time spent
+	fetching them. the call is recorded when the cursor is closed, i.e. when its result is.
+	'''
+
+	def __init__(self, cursor, record, elapsed):
+		self.cursor = cursor
+		self.record = record
+		self.elapsed = elapsed
+		self.rows = 0
+
+	def __getattr__(self, name):
+		return getattr(self.cursor, name)
+
+	def _fetch(self, fetch, *args):
+		start = time.perf_counter()
+		result = fetch(*args)
+		self.elapsed += time.perf_counter() - start
+		return result
+
+	def fetchone(self):
+		row = self._fetch(self.cursor.fetchone)
+		self.rows += row is not None
+		return row
+
+	def fetchmany(self, *args):
+		rows = self._fetch(self.cursor.fetchmany, *args)
+		self.rows += len(rows)
+		return rows
+
+	def fetchall(self):
+		rows = self._fetch(self.cursor.fetchall)
+		self.rows += len(rows)
+		return rows
+
+	def close(self):
+		if self.record is not None:
+			self.record(self.cursor.connection, self.rows, self.elapsed)
+			self.record = None
+		self.cursor.close()
+
+class QueryProfiler:
+	'''
+	per normalized statement: calls, rows changed or fetched, slow calls, total and max latency
+	and a latency histogram. the latency of a select includes fetching its rows.
+	the query plan of a select is captured the first time a call takes at least slow_seconds.
+	'''
+
+	def __init__(self, slow_seconds=SLOW_SECONDS, explain=True):
+		self.slow_seconds = slow_seconds
+		self.explain = explain
+		self.stats = dict()
+		# the first (statement, parameters) of each normalized statement, replayed by advisor.py
+		self.examples = dict()
+		self.lock = threading.Lock()
+		self.engines = []
+
+	def attach(self, engine):
+		event.listen(engine, 'before_cursor_execute', self._before)
+		event.listen(engine, 'after_cursor_execute', self._after)
+		self.engines.append(engine)
+
+	def detach(self):
+		for engine in self.engines:
+			event.remove(engine, 'before_cursor_execute', self._before)
+			event.remove(engine, 'after_cursor_execute', self._after)
+		self.engines = []
+
+	def reset(self):
+		with self.lock:
+			self.stats = dict()
+			self.examples = dict()
+
+	def _before(self, cn, cursor, statement, parameters, context, executemany):
+		cn.info.setdefault('query_start', []).append(time.perf_counter())
+
+	def _after(self, cn, cursor, statement, parameters, context, executemany):
+		elapsed = time.perf_counter() - cn.info['query_start'].pop()
+		key = normalize(statement)
+		with self.lock:
+			s = self.stats.get(key)
+			if s is None:
+				s = {'calls': 0, 'rows': 0, 'slow': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+					'histogram': [0] * (len(BUCKETS) + 1), 'plan': None, 'full_scans': []}
+				self.stats[key] = s
+			if key not in self.examples and not executemany:
+				self.examples[key] = (statement, parameters)
+		select = not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH'))
+		record = functools.partial(self._record, s, statement if select else None, parameters)
+		# the rows of a select are only known once fetched, so its result reads them through _Cursor.
+		# this relies on sqlalchemy internals: the result is built from context.cursor after this event
+		if cursor.description is not None and not executemany and getattr(context, 'cursor', None) is cursor:
+			context.cursor = _Cursor(cursor, record, elapsed)
+		else:
+			# rowcount covers inserts, updates and deletes
+			record(cursor.connection, len(parameters) if executemany else max(cursor.rowcount, 0), elapsed)
+
+	def _record(self, s, statement, parameters, connection, rows, elapsed):
+		# statement is None for statements that are not explained
+		with self.lock:
+			s['calls'] += 1
+			s['rows'] += rows
+			s['slow'] += elapsed >= self.slow_seconds
+			s['total_seconds'] += elapsed
+			s['max_seconds'] = max(s['max_seconds'], elapsed)
+			s['histogram'][bisect_left(BUCKETS, elapsed)] += 1
+			explain = self.explain and statement is not None and s['plan'] is None and elapsed >= self.slow_seconds
+			if explain:
+				# claimed, concurrent slow calls explain once
+				s['plan'] = []
+		if explain:
+			plan = [r[-1] for r in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+			with self.lock:
+				s['plan'] = plan
+				s['full_scans'] = full_scans(plan)
+
+	def profile(self):
+		# statistics by normalized statement, slowest in total first, selects still being fetched have no calls yet
+		with self.lock:
+			stats = {k: dict(v) for k, v in self.stats.items() if v['calls'] > 0}
+		return dict(sorted(stats.items(), key=lambda kv: -kv[1]['total_seconds']))
+
+	def report(self, top=20):
+		lines = []
+		for statement, s in list(self.profile().items())[:top]:
+			lines.append(f"{s['total_seconds']:.3f}s total, {s['calls']} calls, " + \
+				f"{1000 * s['total_seconds'] / s['calls']:.2f}ms mean, {1000 * s['max_seconds']:.2f}ms max, {s['slow']} slow, {s['rows']} rows")
+			lines.append(f'  {statement[:200]}')
+			if len(s['full_scans']) > 0:
+				lines.append(f"  full scan of {', '.join(s['full_scans'])}")
+			for detail in s['plan'] or []:
+				lines.append(f'    {detail}')
+		return '\n'.join(lines)
+
+	def dump(self, path):
+		with open(path, 'w') as f:
+			json.dump({'buckets': BUCKETS, 'statements': self.profile()}, f, indent=1)
+		print(f'finished writing the query profile to {path}.')
@@ -0,0 +1,113 @@
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+import heapq
+from itertools import groupby
+from operator import itemgetter
+import time
+from sqlalchemy import select
+
+from entities_ana import DMCommunicationHistory, EmailCommunicationHistory, ResponderHistory, \
+	ResponseAttribution, WTCommunicationHistory
+
+RULES = ['last_touch', 'first_touch', 'linear']
+
+# days before the application date a communication can be credited
+LOOKBACK_DAYS = {'dm': 90, 'email': 30, 'wt': 14}
+
+def attribute(db, rules=RULES, lookback=LOOKBACK_DAYS):
+	'''
+	credit communications within the lookback windows of each response.
+	responders and the three communication histories are read as streams sorted by
+	(cims_acct_key, date) and merge-joined, so only the history of one account is in memory.
+	results replace the rows of the same rules in response_attribution in one transaction.
+	'''
+	start_time = time.time()
+	stats = {'responders': 0, 'attributed': 0}
+	rows = _attribute(_responders(db), _touches(db), rules, lookback, stats)
+	total = db.replace(ResponseAttribution, 'rule', rules, rows)
+	print(f"finished attributing {stats['attributed']} of {stats['responders']} responses ({total} credits), " + \
+		f'took {int(time.time() - start_time)}s.')
+	return stats
+
+def credits(touches, rule):
+	# credit of each touch, touches are sorted by date
+	if rule == 'last_touch':
+		return [0.0] * (len(touches) - 1) + [1.0]
+	if rule == 'first_touch':
+		return [1.0] + [0.0] * (len(touches) - 1)
+	if rule == 'linear':
+		return [1.0 / len(touches)] * len(touches)
+	raise ValueError(f'unknown attribution rule {rule}.')
+
+def _attribute(responders, touches, rules, lookback, stats):
+	max_lookback = timedelta(days=max(lookback.values()))
+	windows = {c: timedelta(days=d) for c, d in lookback.items()}
+	touch_groups = groupby(touches, key=itemgetter(0))
+	current = next(touch_groups, None)
+	for account, group in groupby(responders, key=lambda r: r.cims_acct_key):
+		while current is not None and current[0] < account:
+			current = next(touch_groups, None)
+		history = list(current[1]) if current is not None and current[0] == account else []
+		current = next(touch_groups, None) if len(history) > 0 else current
+		dates = [t[1] for t in history]
+		for r in group:
+			stats['responders'] += 1
+			lo = bisect_left(dates, r.application_date - max_lookback)
+			hi = bisect_right(dates, r.application_date)
+			candidates = [t for t in history[lo:hi] if t[1] >= r.application_date - windows[t[2]]]
+			if len(candidates) == 0:
+				continue
+			stats['attributed'] += 1
+			for rule in rules:
+				for seq, (touch, credit) in enumerate(zip(candidates, credits(candidates, rule))):
+					if credit == 0:
+						continue
+					_, touch_dt, channel, offer_id, source = touch
+					yield {
+						'rule': rule,
+						'bnk_acct_key': r.bnk_acct_key,
+						'cims_acct_key': account,
+						'mstr_apln_id': r.mstr_apln_id,
+						'email_dlvy_dt': r.email_dlvy_dt,
+						'touch_seq': seq,
+						'channel': channel,
+						'touch_dt': touch_dt,
+						'offer_id': offer_id,
+						'credit': credit,
+						'source_match': _source_match(r, channel, source, touch_dt),
+					}
+
+def _source_match(r, channel, source, touch_dt):
+	if channel == 'dm':
+		return source is not None and source == r.source_cd and touch_dt == r.drop_date
+	if channel == 'email':
+		return source is not None and source == r.em_src_cd and touch_dt == r.email_dlvy_dt
+	return False
+
+def _responders(db):
+	t = ResponderHistory.__table__
+	query = select(t.c.bnk_acct_key, t.c.cims_acct_key, t.c.mstr_apln_id, t.c.application_date, t.c.source_cd,
+		t.c.drop_date, t.c.em_src_cd, t.c.email_dlvy_dt) \
+		.where(t.c.cims_acct_key.is_not(None)) \
+		.order_by(t.c.cims_acct_key, t.c.application_date)
+	return db.stream_rows(ResponderHistory, query)
+
+def _touches(db):
+	# (cims_acct_key, date, channel, offer id, source code) of all channels, sorted by account and date.
+	# db can be a partitions.PartitionedStore, its partitions are merged in the same order
+	streams = []
+	for channel, entity, dt, offer_id, source in [
+		('dm', DMCommunicationHistory, 'mail_drop_dt', 'dm_offer_id', 'unica_source_code'),
+		('email', EmailCommunicationHistory, 'email_dlvy_dt', 'email_offer_id', 'email_offr_srcde'),
+		('wt', WTCommunicationHistory, 'wt_date', 'wt_offer_id', None),
+	]:
+		t = entity.__table__
+		columns = [t.c.cims_acct_key, t.c[dt], t.c[offer_id], t.c[source] if source is not None else None]
+		query = select(*[c for c in columns if c is not None]).where(t.c.cims_acct_key.is_not(None)) \
+			.order_by(t.c.cims_acct_key, t.c[dt])
+		streams.append(_tag(db.stream_rows(entity, query, key=itemgetter(0, 1)), channel, source is not None))
+	return heapq.merge(*streams, key=itemgetter(0, 1))
+
+def _tag(result, channel, with_source):
+	for row in result:
+		yield (row[0], row[1], channel, row[2], row[3] if with_source else None)
@@ -0,0 +1,89 @@
+from multiprocessing import Pool
+import os
+import time
+import numpy as np
+from sqlalchemy import text
+
+from database import SQLite, remove
+from entities import Base
+import engine
+
+def shard_path(db_path, shard):
+	root, ext = os.path.splitext(db_path)
+	return f'{root}_shard{shard}{ext}'
+
+def simulate_shard(task):
+	'''
+	simulate the funnel of a contiguous range of visitors into its own shard file.
+	ids of activities and applications are local to the shard and are renumbered on merge.
+	'''
+	path, seed, start, stop, num_visitors, campaign_ids, channel_ids, customers = task
+	rng = np.random.default_rng(seed)
+	# shards are only read back by the merge, so they never get secondary indexes
+	db = SQLite(path, create=True, renew=True, read_only=False, defer_indexes=True)
+	db.connect(Base)
+	with db.bulk_load():
+		db.stream_insert(engine.simulate_stream(rng, start, stop, num_visitors, campaign_ids, channel_ids, customers))
+	db.close()
+	return path
+
+def simulate_parallel(db, num_workers, seed, num_visitors, campaign_ids, channel_ids, customers):
+	'''
+	partition visitors across a process pool, one independent random stream per shard,
+	so the output only depends on the seed and the number of workers.
+	'''
+	start_time = time.time()
+	seeds = np.random.SeedSequence(seed).spawn(num_workers)
+	bounds = np.linspace(0, num_visitors, num_workers + 1).astype(int)
+	tasks = []
+	for shard in range(num_workers):
+		start, stop = int(bounds[shard]), int(bounds[shard + 1])
+		tasks.append((shard_path(db.db_path, shard), seeds[shard], start, stop, num_visitors,
+			campaign_ids, channel_ids, {v: c for v, c in customers.items() if start <= v < stop}))
+	with Pool(num_workers) as pool:
+		paths = pool.map(simulate_shard, tasks)
+	print(f'finished simulating {num_workers} shards, took {int(time.time() - start_time)}s.')
+	merge_shards(db, paths)
+
+def merge_shards(db, paths):
+	# shards are merged in order, ids continue from the largest id merged so far. the offsets are
+	# kept as running sums of the ids of each (small) shard, main is only scanned once
+	start_time = time.time()
+	with db.engine.connect() as cn:
+		cn = cn.execution_options(isolation_level='AUTOCOMMIT')
+		activity_offset = _next_id(cn, 'main', 'activities', 'activity_id', engine.ACTIVITY_ID)
+		application_offset = _next_id(cn, 'main', 'applications', 'application_id', engine.APPLICATION_ID)
+		for path in paths:
+			cn.execute(text('ATTACH DATABASE :path AS shard'), {'path': path})
+			cn.execute(text('BEGIN'))
+			cn.execute(text('INSERT INTO main.visitors SELECT * FROM shard.visitors'))
+			cn.execute(text('INSERT INTO main.target_population SELECT * FROM shard.target_population'))
+			cn.execute(text(
+				'INSERT INTO main.activities ' + \
+				'(activity_id, visitor_id, clicked_dt, clicked_campaign, clicked_channel) ' + \
+				f"SELECT {_renumber('activity_id', engine.ACTIVITY_ID)}, " + \
+				'visitor_id, clicked_dt, clicked_campaign, clicked_channel FROM shard.activities'
+			), {'offset': activity_offset})
+			cn.execute(text(
+				'INSERT INTO main.applications ' + \
+				'(application_id, status_dt, status, visitor_id, conversion_flag, campaign_id) ' + \
+				f"SELECT {_renumber('application_id', engine.APPLICATION_ID)}, " + \
+				'status_dt, status, visitor_id, conversion_flag, campaign_id FROM shard.applications'
+			), {'offset': application_offset})
+			cn.execute(text('COMMIT'))
+			activity_offset += _next_id(cn, 'shard', 'activities', 'activity_id', engine.ACTIVITY_ID)
+			application_offset += _next_id(cn, 'shard', 'applications', 'application_id', engine.APPLICATION_ID)
+			cn.execute(text('DETACH DATABASE shard'))
+			remove(path)
+	print(f'finished merging {len(paths)} shards into {db.db_path}, took {int(time.time() - start_time)}s.')
+
+def _next_id(cn, schema, table, column, id_format):
+	# compared as numbers, ids wider than their padding do not sort as text (AP999999 > AP1000000)
+	start = len(id_format[0]) + 1
+	last = cn.execute(text(f'SELECT max(CAST(substr({column}, {start}) AS INTEGER)) FROM {schema}.{table}')).scalar()
+	return 0 if last is None else last + 1
+
+def _renumber(column, id_format):
+	# shift the number of a formatted id by :offset
+	prefix, width = id_format
+	return f"printf('{prefix}%0{width}d', CAST(substr({column}, {len(prefix) + 1}) AS INTEGER) + :offset)"
@@ -0,0 +1,139 @@
+import os
+import time
+from sqlalchemy import text
+
+from database import _replace_rows
+from entities_ana import SolicitedHistory, SolicitedOffer, SolicitedWeek
+import loader
+
+# channels of the wide offer columns of solicited_history, e.g. dm_offer_id
+CHANNELS = ['dm', 'email', 'wt']
+VIEW = 'solicited_history_view'
+
+def to_long(row):
+	# a wide solicited_history row as a solicited_weeks row and one solicited_offers row per offer
+	week = {'cims_acct_key': row['cims_acct_key'], 'perf_week': row['perf_week'], 'wt_elig': row.get('wt_elig')}
+	offers = []
+	for channel in CHANNELS:
+		if row.get(f'{channel}_offer_id') is None:
+			continue
+		offers.append({
+			'cims_acct_key': row['cims_acct_key'],
+			'perf_week': row['perf_week'],
+			'channel': channel,
+			'offer_id': row[f'{channel}_offer_id'],
+			'offer_strt_dt': row.get(f'{channel}_offer_strt_dt'),
+			'offer_end_dt': row.get(f'{channel}_offer_end_dt'),
+		})
+	return week, offers
+
+def load(db, path, chunk_size=loader.CHUNK_SIZE, upsert=False, **kwargs):
+	'''
+	stream a wide solicited_history extract into solicited_weeks and solicited_offers,
+	one chunk of rows at a time. the periods loaded are recorded in load_watermarks
+	under solicited_weeks, with the checksums of the wide rows.
+	'''
+	print(f'loading {path} into {SolicitedWeek.__tablename__} and {SolicitedOffer.__tablename__}.')
+	table = SolicitedHistory.__table__
+	stats = dict()
+	rows = loader._collect(loader.read(path, table, **kwargs), table, loader.period_column(table), stats)
+	totals = db.stream_insert(_batches(rows, chunk_size), chunk_size=chunk_size, upsert=upsert)
+	loader._save_watermarks(db, SolicitedWeek.__table__, stats)
+	return totals
+
+def refresh(db, path, chunk_size=loader.CHUNK_SIZE, **kwargs):
+	'''
+	loader.refresh for a wide solicited_history extract: the weeks whose row count or checksum
+	differ from load_watermarks are replaced in solicited_weeks and solicited_offers, both in
+	one transaction, so offers dropped by a restated week are removed as well.
+	'''
+	table = SolicitedHistory.__table__
+	period = loader.period_column(table)
+	stats = dict()
+	for _ in loader._collect(loader.read(path, table, **kwargs), table, period, stats):
+		pass
+	stored = loader.watermarks(db, SolicitedWeek.__tablename__)
+	changed = {p: s for p, s in stats.items() if stored.get(p) != s}
+	print(f'refreshing {path} into {SolicitedWeek.__tablename__} and {SolicitedOffer.__tablename__}, ' + \
+		f'{len(changed)} of {len(stats)} periods changed.')
+	totals = {SolicitedWeek.__tablename__: 0, SolicitedOffer.__tablename__: 0}
+	if len(changed) == 0:
+		return totals
+	start_time = time.time()
+	rows = (r for r in loader.read(path, table, **kwargs) if r.get(period) in changed)
+	with db.engine.begin() as cn:
+		for entity in [SolicitedWeek, SolicitedOffer]:
+			_replace_rows(cn, entity.__table__, period, changed.keys(), [], chunk_size)
+		for entity, chunk in _batches(rows, chunk_size):
+			totals[entity.__tablename__] += _replace_rows(cn, entity.__table__, period, [], chunk, chunk_size)
+	loader._save_watermarks(db, SolicitedWeek.__table__, changed)
+	print(f'finished replacing {len(changed)} periods of solicited_history, took {int(time.time() - start_time)}s.')
+	return totals
+
+def load_directory(db, directory, incremental=False, **kwargs):
+	# load the solicited_history extracts of a directory in long format, or refresh them
+	totals = dict()
+	if not os.path.isdir(directory):
+		return totals
+	f = refresh if incremental else load
+	for name in sorted(os.listdir(directory)):
+		if os.path.splitext(name)[0].lower() == SolicitedHistory.__tablename__:
+			for table, total in f(db, os.path.join(directory, name), **kwargs).items():
+				totals[table] = totals.get(table, 0) + total
+	return totals
+
+def convert(db, delete=False):
+	# copy rows already in the wide solicited_history table to the long tables, delete moves them
+	start_time = time.time()
+	with db.engine.begin() as cn:
+		cn.execute(text('''
+			INSERT OR REPLACE INTO solicited_weeks (cims_acct_key, perf_week, wt_elig)
+			SELECT cims_acct_key, perf_week, wt_elig FROM solicited_history
+		'''))
+		for channel in CHANNELS:
+			cn.execute(text(f'''
+				INSERT OR REPLACE INTO solicited_offers (cims_acct_key, perf_week, channel, offer_id, offer_strt_dt, offer_end_dt)
+				SELECT cims_acct_key, perf_week, '{channel}', {channel}_offer_id, {channel}_offer_strt_dt, {channel}_offer_end_dt
+				FROM solicited_history WHERE {channel}_offer_id IS NOT NULL
+			'''))
+		if delete:
+			cn.execute(text('DELETE FROM solicited_history'))
+	print(f'finished converting solicited_history to long format, took {int(time.time() - start_time)}s.')
+
+def install_view(db):
+	# the wide shape of solicited_history over the long tables
+	columns = []
+	for channel in CHANNELS:
+		for column in ['offer_id', 'offer_strt_dt', 'offer_end_dt']:
+			columns.append(f"max(CASE WHEN o.channel = '{channel}' THEN o.{column} END) AS {channel}_{column}")
+	with db.engine.begin() as cn:
+		cn.execute(text(f'DROP VIEW IF EXISTS {VIEW}'))
+		cn.execute(text(f'''
+			CREATE VIEW {VIEW} AS
+			SELECT w.cims_acct_key, w.perf_week, {', '.join(columns)}, w.wt_elig
+			FROM solicited_weeks w
+			LEFT JOIN solicited_offers o ON o.cims_acct_key = w.cims_acct_key AND o.perf_week = w.perf_week
+			GROUP BY w.cims_acct_key, w.perf_week
+		'''))
+
+def holders(db, offer_id):
+	# (cims_acct_key, perf_week, channel) holding an offer, an index lookup on offer_id
+	with db.engine.connect() as cn:
+		return cn.execute(text(
+			'SELECT cims_acct_key, perf_week, channel FROM solicited_offers WHERE offer_id = :offer_id'
+		), {'offer_id': offer_id}).all()
+
+def _batches(rows, chunk_size):
+	weeks = []
+	offers = []
+	for row in rows:
+		week, week_offers = to_long(row)
+		weeks.append(week)
+		offers.extend(week_offers)
+		if len(weeks) >= chunk_size:
+			yield SolicitedWeek, weeks
+			yield SolicitedOffer, offers
+			weeks, offers = [], []
+	if len(weeks) > 0:
+		yield SolicitedWeek, weeks
+		yield SolicitedOffer, offers
@@ -1,2 +1,8 @@
 DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
-DECIMAL = 4
\ No newline at end of file
+DATE_FORMAT = '%Y-%m-%d'
+DECIMAL = 4
+
+# funnel probabilities used by the simulation
+SUBMISSION_PROB = 0.05
+APPROVE_REJECT_PROB = 0.5
+CANCEL_PROB = 0.1
\ No newline at end of file